@@ -61,3 +61,4 @@ from dcase2020_task2.data_sets.base_data_set import BaseDataSet
 from dcase2020_task2.data_sets.mcm_dataset import MCMDataSet, MachineDataSet
 from dcase2020_task2.data_sets.complement_dataset import ComplementMCMDataSet
 from dcase2020_task2.data_sets.audio_set import AudioSet
+from dcase2020_task2.data_sets.audio_set_shards import AudioSetShards, AudioSetStream
@@ -3,11 +3,36 @@ import torch.utils.data
 import glob
 from dcase2020_task2.data_sets import BaseDataSet, CLASS_MAP, INVERSE_CLASS_MAP, TRAINING_ID_MAP, EVALUATION_ID_MAP, ALL_ID_MAP,\
     enumerate_development_datasets, enumerate_evaluation_datasets
-import librosa
+from dcase2020_task2.data_sets.feature_extraction import FeatureExtraction
+from dcase2020_task2.data_sets.feature_store import load_feature_store, use_feature_store, FEATURE_REGISTRY
+from dcase2020_task2.data_sets.window_index import WindowIndex
+from dcase2020_task2.data_sets.feature_server import share_feature_store
 import numpy as np
 from dcase2020_task2.data_sets import MCMDataSet
 
 
+def audio_set_classes(data_root):
+    """ Returns the sorted class folders of data_root, without the folders of AudioSetShards stores next to them. """
+    return sorted(
+        class_name for class_name in os.listdir(data_root)
+        if os.path.isdir(os.path.join(data_root, class_name))
+        and not class_name.startswith(('shards_', 'pcm_shards_', 'stft_shards_'))
+    )
+
+
+class AudioSetFeatures(FeatureExtraction):
+    """ Extraction of AudioSet clips: resampled to 16 kHz mono and truncated to max_file_length frames. """
+
+    SAMPLE_RATE = 16000
+    MONO = True
+
+    def __feature_parameters__(self):
+        return dict(super().__feature_parameters__(), max_file_length=self.max_file_length)
+
+    def __stft_parameters__(self):
+        return dict(super().__stft_parameters__(), max_file_length=self.max_file_length)
+
+
 class AudioSet(BaseDataSet):
 
     def __init__(
@@ -21,7 +46,11 @@ class AudioSet(BaseDataSet):
             fmin=0,
             normalize_raw=True,
             normalize_spec=False,
-            hop_all=False
+            hop_all=False,
+            num_extraction_workers=None,
+            extraction_backend='librosa',
+            storage_dtype='float32',
+            pcm_storage_dtype=None
     ):
         self.data_root = data_root
         self.context = context
@@ -33,6 +62,10 @@ class AudioSet(BaseDataSet):
         self.hop_all = hop_all
         self.normalize_raw = normalize_raw
         self.normalize_spec = normalize_spec
+        self.num_extraction_workers = num_extraction_workers
+        self.extraction_backend = extraction_backend
+        self.storage_dtype = storage_dtype
+        self.pcm_storage_dtype = pcm_storage_dtype
 
         kwargs = {
             'data_root': self.data_root,
@@ -44,14 +77,21 @@ class AudioSet(BaseDataSet):
             'normalize': self.normalize_raw,
             'fmin': self.fmin,
             'hop_all': self.hop_all,
-            'normalize_spec': self.normalize_spec
+            'normalize_spec': self.normalize_spec,
+            'num_extraction_workers': self.num_extraction_workers,
+            'extraction_backend': self.extraction_backend,
+            'storage_dtype': self.storage_dtype,
+            'pcm_storage_dtype': self.pcm_storage_dtype
         }
 
-        class_names = sorted([class_name for class_name in os.listdir(data_root) if os.path.isdir(os.path.join(data_root, class_name))])
+        class_names = audio_set_classes(data_root)
 
+        # file_ids of the batches index into files
+        self.files = []
         training_sets = []
         for class_name in class_names:
-            training_sets.append(AudioSetClassSubset(class_name, **kwargs))
+            training_sets.append(AudioSetClassSubset(class_name, first_file_id=len(self.files), **kwargs))
+            self.files += training_sets[-1].files
 
         self.training_set = torch.utils.data.ConcatDataset(training_sets)
         self.validation_set = None
@@ -68,7 +108,7 @@ class AudioSet(BaseDataSet):
         return self.validation_set
 
 
-class AudioSetClassSubset(torch.utils.data.Dataset):
+class AudioSetClassSubset(AudioSetFeatures, torch.utils.data.Dataset):
 
     def __init__(
             self,
@@ -84,7 +124,12 @@ class AudioSetClassSubset(torch.utils.data.Dataset):
             fmin=0,
             hop_all=False,
             max_file_per_class=10,
-            max_file_length=350
+            max_file_length=350,
+            num_extraction_workers=None,
+            extraction_backend='librosa',
+            storage_dtype='float32',
+            pcm_storage_dtype=None,
+            first_file_id=0
     ):
 
         self.num_mel = num_mel
@@ -100,6 +145,10 @@ class AudioSetClassSubset(torch.utils.data.Dataset):
         self.max_file_per_class = max_file_per_class
         self.max_file_length = max_file_length
         self.normalize_spec = normalize_spec
+        self.num_extraction_workers = num_extraction_workers
+        self.extraction_backend = extraction_backend
+        self.storage_dtype = storage_dtype
+        self.pcm_storage_dtype = pcm_storage_dtype
 
         files = glob.glob(os.path.join(data_root, class_name, '*.wav'))
 
@@ -108,37 +157,46 @@ class AudioSetClassSubset(torch.utils.data.Dataset):
         files = sorted(files)[:max_file_per_class]
         self.files = files
 
-        self.meta_data = self.__load_meta_data__(files)
-        self.data = self.__load_data__(files)
+        self.file_ids = np.arange(first_file_id, first_file_id + len(files), dtype=np.int32)
+        self.cache_path = self.__cache_path__()
+        self.store_use = use_feature_store(self.cache_path)
+        self.data = FEATURE_REGISTRY.acquire(self.cache_path, lambda: self.__load_data__(files))
 
-        self.index_map = {}
-        ctr = 0
-        for i, file in enumerate(self.data):
-            for j in range(file.shape[-1] + 1 - context):
-                self.index_map[ctr] = (i, j)
-                ctr += 1
-        self.length = ctr
+        self.index_map = WindowIndex(self.data.lengths + 1 - context)
+        self.length = len(self.index_map)
 
     def __getitem__(self, item):
         file_idx, offset = self.index_map[item]
-        observation = self.data[file_idx][:, offset:offset + self.context]
-        meta_data = self.meta_data[file_idx].copy()
-        meta_data['observations'] = observation[None]
+        observation = self.data.window(file_idx, offset, self.context)
+        return {
+            'targets': 1,
+            'machine_types': -1,
+            'machine_ids': -1,
+            'file_ids': int(self.file_ids[file_idx]),
+            'observations': observation[None]
+        }
 
-        return meta_data
+    def get_batch(self, items, crops=None):
+        file_indices, offsets = self.index_map.lookup(items)
+        observations = np.empty((len(file_indices), 1) + self.data.feature_shape + (self.context,), dtype=np.float32)
+        self.data.windows(file_indices, offsets, self.context, out=observations[:, 0])
+        return {
+            'observations': observations,
+            'targets': np.ones(len(file_indices), dtype=np.int64),
+            'machine_types': np.full(len(file_indices), -1, dtype=np.int64),
+            'machine_ids': np.full(len(file_indices), -1, dtype=np.int64),
+            'file_ids': self.file_ids[file_indices]
+        }
 
     def __len__(self):
         return self.length
 
-    def __load_meta_data__(self, files):
-        data = []
-        for f in files:
-            md = self.__get_meta_data__(f)
-            data.append(md)
-        return data
+    def __del__(self):
+        if hasattr(self, 'data'):
+            FEATURE_REGISTRY.release(self.cache_path)
 
-    def __load_data__(self, files):
-        file_name = "{}_{}_{}_{}_{}_{}_{}_{}.npz".format(
+    def __cache_name__(self):
+        return "{}_{}_{}_{}_{}_{}_{}_{}".format(
             self.num_mel,
             self.n_fft,
             self.hop_size,
@@ -148,61 +206,24 @@ class AudioSetClassSubset(torch.utils.data.Dataset):
             self.class_name,
             self.normalize_spec
         )
-        file_path = os.path.join(self.data_root, file_name)
-
-        data = []
-        if os.path.exists(file_path):
-            print('Loading audio set class {} '.format(self.class_name))
-            container = np.load(file_path)
-            data = [container[key] for key in container]
-        else:
-            print('Loading & saving audio set class {} '.format(self.class_name))
-            for i, f in enumerate(files):
-                file = self.__load_preprocess_file__(f)
-                if file.shape[1] > self.max_file_length:
-                    print(f'File too long: {f} - {file.shape[1]}')
-                    file = file[:, :self.max_file_length]
-                data.append(file)
-            np.savez(file_path, *data)
-        return data
-
-    def __load_preprocess_file__(self, file):
-        x, sr = librosa.load(file, sr=16000, mono=True)
-        if len(x) > (self.max_file_length + 1 * self.hop_size) + self.n_fft:
-            x = x[:(self.max_file_length + 1) * self.hop_size + self.n_fft]
-
-        if self.normalize:
-            x = (x - x.mean()) / x.std()
-
-        x = librosa.feature.melspectrogram(
-            y=x,
-            sr=sr,
-            n_fft=self.n_fft,
-            hop_length=self.hop_size,
-            n_mels=self.num_mel,
-            power=self.power,
-            fmin=self.fmin
-        )
-
-        if self.power == 1:
-            x = librosa.core.amplitude_to_db(x)
-        elif self.power == 2:
-            x = librosa.core.power_to_db(x)
-        else:
-            raise AttributeError
 
-        if self.normalize_spec:
-            x = (x - x.mean(axis=-1, keepdims=True)) / x.std(axis=-1, keepdims=True)
+    def __load_data__(self, files):
+        store = load_feature_store(
+            self.cache_path,
+            files,
+            self.__feature_parameters__(),
+            self.__extract_features__,
+            'audio set class {}'.format(self.class_name),
+            storage_dtype=self.storage_dtype
+        )
+        return share_feature_store(store)
 
-        return x
+    def __source__(self, file):
+        # PCM and STFT stores hold the files of the class
+        return self.class_name
 
-    def __get_meta_data__(self, file_path):
-        return {
-            'targets': 1,
-            'machine_types': -1,
-            'machine_ids': -1,
-            'file_ids': os.sep.join(os.path.normpath(file_path).split(os.sep)[-4:])
-        }
+    def __source_files__(self, name):
+        return self.files, None
 
 
 if __name__ == '__main__':
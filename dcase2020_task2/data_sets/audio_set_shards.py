@@ -0,0 +1,245 @@
+import os
+import torch.utils.data
+import numpy as np
+from dcase2020_task2.data_sets import BaseDataSet
+from dcase2020_task2.data_sets.audio_set import AudioSetFeatures, audio_set_classes
+from dcase2020_task2.data_sets.feature_store import FeatureStore, load_feature_store, use_feature_store
+from dcase2020_task2.data_sets.window_index import WindowIndex
+
+
+# clips per shard
+SHARD_SIZE = 500
+
+
+def list_audio_set_files(data_root):
+    """ Returns all clips below data_root (<class name>/*.wav), sorted by class and name. """
+    files = []
+    for class_name in audio_set_classes(data_root):
+        files += sorted(e.path for e in os.scandir(os.path.join(data_root, class_name)) if e.name.endswith('.wav'))
+    return files
+
+
+class AudioSetShards(AudioSetFeatures, BaseDataSet):
+    """
+    AudioSet as outlier corpus of arbitrary size: all clips (<data_root>/<class name>/*.wav, sorted by class and name)
+    are split into shards of shard_size clips. Every shard is a FeatureStore of its own (shards_<...>/shard_<i> in the
+    data root), so shards are built, validated and updated independently, and a shard is the unit of reading. With a
+    pcm_storage_dtype, the resampled audio of every shard is kept in pcm_shards_<...>/shard_<i>.
+    shard_ids selects the shards to build and stream (default: all).
+
+    The training data set is an AudioSetStream, which streams batches of random windows from a few shards at a time.
+    file_ids of its batches index into files.
+    """
+
+    def __init__(
+            self,
+            data_root=os.path.join(os.path.expanduser('~'), 'shared', 'audioset', 'audiosetdata'),
+            context=5,
+            num_mel=128,
+            n_fft=1024,
+            hop_size=512,
+            power=2.0,
+            fmin=0,
+            normalize_raw=True,
+            normalize_spec=False,
+            hop_all=False,
+            num_extraction_workers=None,
+            extraction_backend='librosa',
+            storage_dtype='float32',
+            pcm_storage_dtype=None,
+            shard_size=SHARD_SIZE,
+            max_file_length=None,
+            batch_size=32,
+            pool_size=4,
+            windows_per_shard=None,
+            seed=None,
+            shard_ids=None
+    ):
+        # windows are always drawn at random, hop_all is accepted for compatibility with the feature settings
+        self.data_root = data_root
+        self.context = context
+        self.num_mel = num_mel
+        self.n_fft = n_fft
+        self.hop_size = hop_size
+        self.power = power
+        self.fmin = fmin
+        self.normalize = normalize_raw
+        self.normalize_spec = normalize_spec
+        self.num_extraction_workers = num_extraction_workers
+        self.extraction_backend = extraction_backend
+        self.storage_dtype = storage_dtype
+        self.pcm_storage_dtype = pcm_storage_dtype
+        self.shard_size = shard_size
+        self.max_file_length = max_file_length
+
+        self.files = list_audio_set_files(data_root)
+        assert len(self.files) > 0
+        self.positions = {f: i for i, f in enumerate(self.files)}
+
+        if shard_ids is None:
+            shard_ids = range((len(self.files) + shard_size - 1) // shard_size)
+
+        shard_root = self.__shard_root__()
+        shards = []
+        self.stores = []
+        # the shards are opened by the DataLoader workers, they must not be pruned while this data set exists
+        self.store_uses = []
+        for shard_id in shard_ids:
+            path = os.path.join(shard_root, 'shard_{:05d}'.format(shard_id))
+            self.store_uses.append(use_feature_store(path))
+            self.stores.append(self.__build_shard__(path, self.__shard_files__(shard_id)))
+            shards.append((path, shard_id * shard_size))
+
+        self.training_set = AudioSetStream(
+            shards,
+            context,
+            batch_size,
+            pool_size=pool_size,
+            windows_per_shard=windows_per_shard,
+            seed=seed
+        )
+        self.validation_set = None
+
+    @property
+    def observation_shape(self) -> tuple:
+        return 1, self.num_mel, self.context
+
+    def training_data_set(self):
+        return self.training_set
+
+    def validation_data_set(self):
+        return self.validation_set
+
+    def __shard_files__(self, shard_id):
+        return self.files[shard_id * self.shard_size:(shard_id + 1) * self.shard_size]
+
+    def __shard_root__(self):
+        path = self.__cache_path__()
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def __cache_name__(self):
+        return "shards_{}_{}_{}_{}_{}_{}_{}_{}_{}".format(
+            self.num_mel,
+            self.n_fft,
+            self.hop_size,
+            self.power,
+            self.normalize,
+            self.fmin,
+            self.normalize_spec,
+            self.max_file_length,
+            self.shard_size
+        )
+
+    def __build_shard__(self, path, files):
+        return load_feature_store(
+            path,
+            files,
+            self.__feature_parameters__(),
+            self.__extract_features__,
+            'audio set shard {}'.format(os.path.basename(path)),
+            storage_dtype=self.storage_dtype
+        )
+
+    def __source__(self, file):
+        # PCM and STFT stores follow the shards
+        return 'shard_{:05d}'.format(self.positions[file] // self.shard_size)
+
+    def __source_files__(self, name):
+        return self.__shard_files__(int(name[len('shard_'):])), None
+
+    def __pcm_cache_path__(self, name):
+        return self.__source_path__('pcm_shards_{}_{}'.format(self.shard_size, self.pcm_storage_dtype), name)
+
+    def __stft_cache_path__(self, name):
+        folder_name = 'stft_shards_{}_{}_{}_{}_{}'.format(
+            self.n_fft, self.hop_size, self.normalize, self.max_file_length, self.shard_size
+        )
+        if self.__lossy_pcm__():
+            folder_name += '_pcm_' + self.pcm_storage_dtype
+        return self.__source_path__(folder_name, name)
+
+    def __source_path__(self, folder_name, name):
+        folder = os.path.join(self.data_root, folder_name)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, name)
+
+
+class AudioSetStream(torch.utils.data.IterableDataset):
+    """
+    Endless stream of batches of random windows from a pool of shards.
+
+    Every DataLoader worker streams from its own share of the shards. It keeps pool_size shards in memory, each read
+    with one sequential pass, and draws the windows of a batch uniformly from all windows of the pool. A shard is
+    replaced by the next one of a shuffled order once windows_per_shard windows (default: as many as it holds) were
+    drawn from it. Memory is therefore bounded by pool_size shards per worker, independently of the number of clips.
+    Use with batch_size=None, batches are assembled here.
+    """
+
+    def __init__(self, shards, context, batch_size, pool_size=4, windows_per_shard=None, seed=None):
+        self.shards = shards
+        self.context = context
+        self.batch_size = batch_size
+        self.pool_size = pool_size
+        self.windows_per_shard = windows_per_shard
+        self.seed = int(np.random.randint(2 ** 31)) if seed is None else seed
+
+    def __iter__(self):
+        worker = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker is None else (worker.id, worker.num_workers)
+        shards = self.shards[worker_id::num_workers] or self.shards
+        rng = np.random.default_rng([self.seed, worker_id])
+
+        order = []
+        pool = []
+        while True:
+            while len(pool) < min(self.pool_size, len(shards)):
+                if len(order) == 0:
+                    order = list(rng.permutation(len(shards)))
+                path, first_file_id = shards[order.pop()]
+                if any(slot['path'] == path for slot in pool):
+                    continue
+                pool.append(self.__load_shard__(path, first_file_id))
+
+            yield self.__draw_batch__(pool, rng)
+            pool = [slot for slot in pool if slot['budget'] > 0]
+
+    def __load_shard__(self, path, first_file_id):
+        store = FeatureStore.open(path)
+        # one sequential read instead of random accesses to the memory map
+        store = FeatureStore(
+            path, np.array(store.data), store.offsets, store.feature_shape, scales=store.scales,
+            shifts=store.shifts, manifest=store.manifest
+        )
+        index = WindowIndex(store.lengths + 1 - self.context)
+        assert len(index) > 0, 'no window of {} frames in {}'.format(self.context, path)
+        return {
+            'path': path,
+            'store': store,
+            'index': index,
+            'first_file_id': first_file_id,
+            'budget': self.windows_per_shard if self.windows_per_shard is not None else len(index)
+        }
+
+    def __draw_batch__(self, pool, rng):
+        sizes = np.array([len(slot['index']) for slot in pool], dtype=np.float64)
+        slots = rng.choice(len(pool), size=self.batch_size, p=sizes / sizes.sum())
+
+        feature_shape = pool[0]['store'].feature_shape
+        observations = np.empty((self.batch_size, 1) + feature_shape + (self.context,), dtype=np.float32)
+        file_ids = np.empty(self.batch_size, dtype=np.int32)
+        for s in np.unique(slots):
+            positions = np.nonzero(slots == s)[0]
+            slot = pool[s]
+            file_indices, offsets = slot['index'].lookup(rng.integers(len(slot['index']), size=len(positions)))
+            observations[positions, 0] = slot['store'].windows(file_indices, offsets, self.context)
+            file_ids[positions] = slot['first_file_id'] + file_indices
+            slot['budget'] -= len(positions)
+
+        return {
+            'observations': observations,
+            'targets': np.ones(self.batch_size, dtype=np.int64),
+            'machine_types': np.full(self.batch_size, -1, dtype=np.int64),
+            'machine_ids': np.full(self.batch_size, -1, dtype=np.int64),
+            'file_ids': file_ids
+        }
@@ -0,0 +1,314 @@
+import torch.utils.data
+import numpy as np
+
+
+def get_batch(data_set, items, crops=None):
+    """
+    Returns the batch of items of data_set as dict of arrays. Data sets have to implement get_batch, ConcatDatasets
+    are resolved by dispatching each item to its member data set. crops are uniform random numbers in [0, 1), one per
+    item, which select the window position of data sets that crop randomly (hop_all).
+    """
+    items = np.asarray(items, dtype=np.int64)
+
+    if not isinstance(data_set, torch.utils.data.ConcatDataset):
+        return data_set.get_batch(items, crops=crops)
+
+    cumulative_sizes = np.asarray(data_set.cumulative_sizes, dtype=np.int64)
+    members = np.searchsorted(cumulative_sizes, items, side='right')
+
+    batch = None
+    for member in np.unique(members):
+        positions = np.nonzero(members == member)[0]
+        local_items = items[positions] - (cumulative_sizes[member - 1] if member > 0 else 0)
+        member_batch = get_batch(
+            data_set.datasets[member],
+            local_items,
+            crops=None if crops is None else crops[positions]
+        )
+
+        if batch is None:
+            batch = {}
+            for key, value in member_batch.items():
+                if isinstance(value, np.ndarray):
+                    batch[key] = np.empty((len(items),) + value.shape[1:], dtype=value.dtype)
+                else:
+                    batch[key] = [None] * len(items)
+
+        for key, value in member_batch.items():
+            if isinstance(value, np.ndarray):
+                batch[key][positions] = value
+            else:
+                for p, v in zip(positions, value):
+                    batch[key][p] = v
+
+    return batch
+
+
+class WindowBatchSampler(torch.utils.data.Sampler):
+    """
+    Batch sampler that yields (indices, crops) pairs for BatchDataSet.
+
+    The permutation and the crop positions of an epoch are drawn at once from a generator seeded with
+    (seed, epoch) in the main process. Crops are therefore independent of the number of DataLoader workers and
+    reproducible; state_dict/load_state_dict allow to resume the stream in the middle of an epoch.
+
+    With a block_size, shuffling is locality-aware (see block_shuffle): consecutive items, which are adjacent windows
+    in the feature store, are kept together in blocks, so a batch reads from a few contiguous regions instead of
+    faulting in one page per window.
+    """
+
+    def __init__(
+            self,
+            num_items,
+            batch_size,
+            shuffle=False,
+            drop_last=False,
+            seed=None,
+            block_size=None,
+            buffer_size=None
+    ):
+        self.num_items = num_items
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = int(np.random.randint(2 ** 31)) if seed is None else seed
+        self.block_size = block_size
+        self.buffer_size = buffer_size
+        self.epoch = 0
+        self.batch = 0
+
+    def __iter__(self):
+        rng = np.random.default_rng([self.seed, self.epoch])
+        if self.shuffle and self.block_size is not None:
+            order = block_shuffle(self.num_items, self.block_size, self.buffer_size, rng)
+        elif self.shuffle:
+            order = rng.permutation(self.num_items)
+        else:
+            order = np.arange(self.num_items)
+        crops = rng.random(self.num_items)
+
+        while self.batch < len(self):
+            start = self.batch * self.batch_size
+            self.batch += 1
+            yield order[start:start + self.batch_size], crops[start:start + self.batch_size]
+
+        self.epoch += 1
+        self.batch = 0
+
+    def __len__(self):
+        if self.drop_last:
+            return self.num_items // self.batch_size
+        return (self.num_items + self.batch_size - 1) // self.batch_size
+
+    def state_dict(self):
+        return {'seed': self.seed, 'epoch': self.epoch, 'batch': self.batch}
+
+    def load_state_dict(self, state):
+        self.seed, self.epoch, self.batch = state['seed'], state['epoch'], state['batch']
+
+    def advance(self, state, num_batches):
+        """
+        Returns state advanced by num_batches batches. The sampler itself runs ahead of training by the batches the
+        DataLoader prefetched, checkpoints store the state of the batches that were actually consumed.
+        """
+        batch = state['batch'] + num_batches
+        return {'seed': state['seed'], 'epoch': state['epoch'] + batch // len(self), 'batch': batch % len(self)}
+
+
+def block_shuffle(num_items, block_size, buffer_size, rng):
+    """
+    Returns a permutation of num_items that shuffles blocks of block_size consecutive items, then shuffles the items
+    within consecutive chunks of buffer_size (default 16 blocks) of that block order, like a shuffle buffer that is
+    refilled block by block. Block boundaries are shifted by a random offset every epoch, so items are not always
+    grouped with the same neighbours. Every item still appears exactly once per epoch; a batch holds items of about
+    buffer_size / block_size blocks.
+    """
+    if buffer_size is None:
+        buffer_size = 16 * block_size
+    assert block_size > 0 and buffer_size >= block_size
+
+    shift = int(rng.integers(block_size))
+    boundaries = np.arange(shift, num_items, block_size)
+    blocks = np.split(np.arange(num_items), boundaries[boundaries > 0])
+    order = np.concatenate([blocks[b] for b in rng.permutation(len(blocks))])
+
+    for start in range(0, num_items, buffer_size):
+        order[start:start + buffer_size] = rng.permutation(order[start:start + buffer_size])
+    return order
+
+
+class BatchDataSet(torch.utils.data.Dataset):
+    """ View of a data set whose items are whole batches, indexed by (indices, crops) from a WindowBatchSampler. """
+
+    def __init__(self, data_set):
+        self.data_set = data_set
+
+    def __getitem__(self, items):
+        indices, crops = items
+        return get_batch(self.data_set, indices, crops=crops)
+
+    def __len__(self):
+        return len(self.data_set)
+
+
+def batch_data_loader(
+        data_set,
+        batch_size,
+        shuffle=False,
+        num_workers=0,
+        drop_last=False,
+        seed=None,
+        block_size=None,
+        buffer_size=None
+):
+    """
+    Drop-in replacement for torch.utils.data.DataLoader that assembles each batch with one call to get_batch
+    instead of batch_size calls to __getitem__ followed by default_collate. The WindowBatchSampler is available as
+    data_loader.sampler.
+    """
+    return torch.utils.data.DataLoader(
+        BatchDataSet(data_set),
+        sampler=WindowBatchSampler(
+            len(data_set),
+            batch_size,
+            shuffle=shuffle,
+            drop_last=drop_last,
+            seed=seed,
+            block_size=block_size,
+            buffer_size=buffer_size
+        ),
+        batch_size=None,
+        num_workers=num_workers
+    )
+
+
+class MixedBatchSampler(torch.utils.data.Sampler):
+    """
+    Yields pairs of (indices, crops) batches, one from the normal and one from the complement data set.
+
+    An epoch is one pass over the normal data set; the complement sampler runs on independently, starting a new
+    epoch whenever it is exhausted.
+    """
+
+    def __init__(
+            self,
+            num_normal,
+            num_complement,
+            normal_batch_size,
+            complement_batch_size,
+            seed=None,
+            block_size=None,
+            buffer_size=None
+    ):
+        self.normal_sampler = WindowBatchSampler(
+            num_normal,
+            normal_batch_size,
+            shuffle=True,
+            seed=seed,
+            block_size=block_size,
+            buffer_size=buffer_size
+        )
+        self.complement_sampler = WindowBatchSampler(
+            num_complement,
+            complement_batch_size,
+            shuffle=True,
+            drop_last=True,
+            seed=None if seed is None else seed + 1,
+            block_size=block_size,
+            buffer_size=buffer_size
+        )
+        self.complement_iterator = None
+
+    def __iter__(self):
+        for normal_batch in self.normal_sampler:
+            yield normal_batch, self.__next_complement_batch__()
+
+    def __next_complement_batch__(self):
+        while True:
+            if self.complement_iterator is None:
+                self.complement_iterator = iter(self.complement_sampler)
+            try:
+                return next(self.complement_iterator)
+            except StopIteration:
+                self.complement_iterator = None
+
+    def __len__(self):
+        return len(self.normal_sampler)
+
+    def state_dict(self):
+        return {'normal': self.normal_sampler.state_dict(), 'complement': self.complement_sampler.state_dict()}
+
+    def load_state_dict(self, state):
+        self.normal_sampler.load_state_dict(state['normal'])
+        self.complement_sampler.load_state_dict(state['complement'])
+        self.complement_iterator = None
+
+    def advance(self, state, num_batches):
+        """ Returns state advanced by num_batches pairs of batches, see WindowBatchSampler.advance. """
+        return {
+            'normal': self.normal_sampler.advance(state['normal'], num_batches),
+            'complement': self.complement_sampler.advance(state['complement'], num_batches)
+        }
+
+
+class MixedBatchDataSet(torch.utils.data.Dataset):
+    """
+    Assembles outlier exposure batches: normal windows followed by complement windows, with the 'abnormal' target
+    (0 for normal, 1 for complement windows) already filled in.
+    """
+
+    def __init__(self, normal_data_set, complement_data_set):
+        self.normal_data_set = normal_data_set
+        self.complement_data_set = complement_data_set
+
+    def __getitem__(self, items):
+        (normal_indices, normal_crops), (complement_indices, complement_crops) = items
+        normal = get_batch(self.normal_data_set, normal_indices, crops=normal_crops)
+        complement = get_batch(self.complement_data_set, complement_indices, crops=complement_crops)
+
+        batch = {}
+        for key in normal:
+            if isinstance(normal[key], np.ndarray):
+                batch[key] = np.concatenate([normal[key], complement[key]])
+            else:
+                batch[key] = normal[key] + complement[key]
+        batch['abnormal'] = np.concatenate([
+            np.zeros((len(normal_indices), 1), dtype=np.float32),
+            np.ones((len(complement_indices), 1), dtype=np.float32)
+        ])
+        return batch
+
+    def __len__(self):
+        return len(self.normal_data_set)
+
+
+def mixed_batch_data_loader(
+        normal_data_set,
+        complement_data_set,
+        batch_size,
+        complement_ratio=1.0,
+        num_workers=0,
+        seed=None,
+        block_size=None,
+        buffer_size=None
+):
+    """
+    Single loader for outlier exposure: every batch holds batch_size normal and round(batch_size * complement_ratio)
+    complement windows. The MixedBatchSampler is available as data_loader.sampler.
+    """
+    complement_batch_size = int(round(batch_size * complement_ratio))
+    assert complement_batch_size > 0
+    return torch.utils.data.DataLoader(
+        MixedBatchDataSet(normal_data_set, complement_data_set),
+        sampler=MixedBatchSampler(
+            len(normal_data_set),
+            len(complement_data_set),
+            batch_size,
+            complement_batch_size,
+            seed=seed,
+            block_size=block_size,
+            buffer_size=buffer_size
+        ),
+        batch_size=None,
+        num_workers=num_workers
+    )
@@ -49,7 +49,11 @@ class ComplementMCMDataSet(BaseDataSet):
             normalize_raw=True,
             normalize_spec=False,
             hop_all=False,
-            valid_types='strict'
+            valid_types='strict',
+            num_extraction_workers=None,
+            extraction_backend='librosa',
+            storage_dtype='float32',
+            pcm_storage_dtype=None
     ):
 
         assert type(machine_type) == int and type(machine_id) == int
@@ -67,6 +71,10 @@ class ComplementMCMDataSet(BaseDataSet):
         self.normalize_raw = normalize_raw
         self.normalize_spec = normalize_spec
         self.valid_types = valid_types
+        self.num_extraction_workers = num_extraction_workers
+        self.extraction_backend = extraction_backend
+        self.storage_dtype = storage_dtype
+        self.pcm_storage_dtype = pcm_storage_dtype
 
         kwargs = {
             'data_root': self.data_root,
@@ -78,15 +86,20 @@ class ComplementMCMDataSet(BaseDataSet):
             'normalize': self.normalize_raw,
             'fmin': self.fmin,
             'hop_all': self.hop_all,
-            'normalize_spec': self.normalize_spec
+            'normalize_spec': self.normalize_spec,
+            'num_extraction_workers': self.num_extraction_workers,
+            'extraction_backend': self.extraction_backend,
+            'storage_dtype': self.storage_dtype,
+            'pcm_storage_dtype': self.pcm_storage_dtype
         }
 
         training_sets = []
 
+        # members with a valid store open it on first access; all others are built here, before workers are forked
         for type_ in VALID_TYPES[self.valid_types][machine_type]:
             for id_ in ALL_ID_MAP[type_]:
                 if type_ != machine_type or id_ != machine_id:
-                    t = MachineDataSet(type_, id_, mode='training', **kwargs)
+                    t = MachineDataSet(type_, id_, mode='training', lazy=True, **kwargs)
                     training_sets.append(t)
 
         self.training_set = torch.utils.data.ConcatDataset(training_sets)
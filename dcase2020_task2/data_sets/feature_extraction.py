@@ -0,0 +1,224 @@
+import os
+import librosa
+from dcase2020_task2.data_sets.features import PAD_MODE, map_files, librosa_log_mel, torch_log_mel, \
+    torch_stft_magnitude, log_mel_from_magnitude
+from dcase2020_task2.data_sets.feature_store import load_feature_store
+
+
+class FeatureExtraction:
+    """
+    Log-mel feature extraction of the data sets backed by feature stores (MachineDataSet, AudioSetClassSubset,
+    AudioSetShards).
+
+    Audio is decoded at SAMPLE_RATE (None: native rate), as mono if MONO, truncated to about max_file_length frames
+    (None: not truncated) and normalized (normalize); the extraction_backend ('librosa', 'torch' or 'stft') turns it
+    into log-mel spectrograms of num_mel bands. The files of a data set belong to sources (__source__), e.g. one
+    machine type/id/mode or one AudioSet shard. With a pcm_storage_dtype, the decoded audio of every source is kept in
+    a PCM store, the 'stft' backend keeps the STFT magnitudes of every source in a store; both are shared by all mel
+    front ends.
+
+    Subclasses set the extraction attributes and implement __cache_name__, __source__ and __source_files__.
+    """
+
+    BACKENDS = ['librosa', 'torch', 'stft']
+
+    SAMPLE_RATE = None
+    MONO = False
+
+    # STFT magnitudes are four times larger than 128 mel bands
+    STFT_STORAGE_DTYPE = 'float16'
+
+    def __cache_path__(self):
+        file_name = self.__cache_name__()
+        if self.storage_dtype != 'float32':
+            file_name += '_' + self.storage_dtype
+        # stores of different backends must neither overwrite each other nor share a registry entry
+        if self.extraction_backend != 'librosa':
+            file_name += '_' + self.extraction_backend
+        if self.__lossy_pcm__():
+            file_name += '_pcm_' + self.pcm_storage_dtype
+        return os.path.join(self.data_root, file_name)
+
+    def __lossy_pcm__(self):
+        """
+        Whether features are extracted from PCM stores that do not hold the decoded audio exactly. float32 is lossless,
+        int16 only for 16 bit files that are neither resampled nor mixed down; all other tiers are lossy.
+        """
+        if self.pcm_storage_dtype is None or self.pcm_storage_dtype == 'float32':
+            return False
+        return self.pcm_storage_dtype != 'int16' or self.SAMPLE_RATE is not None or self.MONO
+
+    def __feature_parameters__(self):
+        parameters = {
+            'num_mel': self.num_mel,
+            'n_fft': self.n_fft,
+            'hop_size': self.hop_size,
+            'power': self.power,
+            'normalize': self.normalize,
+            'fmin': self.fmin,
+            'normalize_spec': self.normalize_spec,
+            'sr': self.SAMPLE_RATE,
+            'mono': self.MONO,
+            'librosa': librosa.__version__,
+            'backend': self.extraction_backend,
+            'storage_dtype': self.storage_dtype
+        }
+        if self.extraction_backend != 'librosa':
+            # torch stores built before the STFT padding followed librosa have no pad_mode and are rebuilt
+            parameters['pad_mode'] = PAD_MODE
+        if self.__lossy_pcm__():
+            parameters['pcm_storage_dtype'] = self.pcm_storage_dtype
+        return parameters
+
+    def __extract_features__(self, files):
+        if self.extraction_backend == 'librosa' and self.pcm_storage_dtype is None:
+            data = map_files(self.__load_preprocess_file__, files, num_workers=self.num_extraction_workers)
+        elif self.extraction_backend == 'librosa':
+            data = map_files(
+                self.__preprocess_signal__, self.__load_signals__(files), num_workers=self.num_extraction_workers
+            )
+        elif self.extraction_backend == 'torch':
+            signals = self.__load_signals__(files)
+            sr = signals[0][1]
+            assert all(sr == sr_ for _, sr_ in signals)
+            data = torch_log_mel(
+                [x for x, _ in signals], sr, self.n_fft, self.hop_size, self.num_mel, self.power, self.fmin,
+                self.normalize_spec
+            )
+        elif self.extraction_backend == 'stft':
+            data = self.__log_mel_from_stft__(files)
+        else:
+            raise AttributeError('Unknown extraction backend: {}'.format(self.extraction_backend))
+
+        if self.max_file_length is not None:
+            for i, (f, x) in enumerate(zip(files, data)):
+                if x.shape[1] > self.max_file_length:
+                    print(f'File too long: {f} - {x.shape[1]}')
+                    data[i] = x[:, :self.max_file_length]
+        return data
+
+    def __load_sources__(self, files, cache_path, parameters, extract, storage_dtype, description):
+        """
+        Loads (or builds with extract) the store of every source of files, at cache_path(source name). Returns a
+        (store, position) pair per file.
+        """
+        items = {}
+        for name in sorted(set(self.__source__(f) for f in files)):
+            source_files, signatures = self.__source_files__(name)
+            store = load_feature_store(
+                cache_path(name),
+                source_files,
+                parameters,
+                extract,
+                '{} of {}'.format(description, name),
+                storage_dtype=storage_dtype,
+                signatures=signatures
+            )
+            positions = {f: i for i, f in enumerate(source_files)}
+            for f in files:
+                if f in positions:
+                    items[f] = (store, positions[f])
+        return [items[f] for f in files]
+
+    def __log_mel_from_stft__(self, files, batch_size=64):
+        """
+        Derives log-mel spectrograms from the cached STFT magnitudes of the sources of files, which only depend on
+        n_fft, hop_size and the decoding; they are computed once and shared by all mel front ends (num_mel, fmin,
+        power, normalize_spec).
+        """
+        magnitudes = self.__load_sources__(
+            files,
+            self.__stft_cache_path__,
+            self.__stft_parameters__(),
+            self.__extract_stft__,
+            self.STFT_STORAGE_DTYPE,
+            'STFT magnitudes'
+        )
+        sample_rates = [self.SAMPLE_RATE or store.sample_rates[i] for store, i in magnitudes]
+        assert all(sr == sample_rates[0] for sr in sample_rates)
+
+        features = []
+        for start in range(0, len(files), batch_size):
+            features += log_mel_from_magnitude(
+                [store[i] for store, i in magnitudes[start:start + batch_size]],
+                sample_rates[0], self.n_fft, self.num_mel, self.power, self.fmin, self.normalize_spec,
+                batch_size=batch_size
+            )
+        return features
+
+    def __extract_stft__(self, files):
+        signals = self.__load_signals__(files)
+        return torch_stft_magnitude([x for x, _ in signals], self.n_fft, self.hop_size)
+
+    def __stft_cache_path__(self, name):
+        file_name = "stft_{}_{}_{}_{}".format(self.n_fft, self.hop_size, name, self.normalize)
+        if self.__lossy_pcm__():
+            file_name += '_pcm_' + self.pcm_storage_dtype
+        return os.path.join(self.data_root, file_name)
+
+    def __stft_parameters__(self):
+        parameters = {
+            'n_fft': self.n_fft,
+            'hop_size': self.hop_size,
+            'normalize': self.normalize,
+            'sr': self.SAMPLE_RATE,
+            'mono': self.MONO,
+            'librosa': librosa.__version__,
+            'storage_dtype': self.STFT_STORAGE_DTYPE
+        }
+        if self.__lossy_pcm__():
+            parameters['pcm_storage_dtype'] = self.pcm_storage_dtype
+        return parameters
+
+    def __load_signals__(self, files):
+        """ Returns (signal, sample rate) of every file, from the PCM stores if there is a pcm_storage_dtype. """
+        if self.pcm_storage_dtype is None:
+            return map_files(self.__load_raw_file__, files, num_workers=self.num_extraction_workers)
+
+        pcm = self.__load_sources__(
+            files,
+            self.__pcm_cache_path__,
+            self.__pcm_parameters__(),
+            self.__decode_files__,
+            self.pcm_storage_dtype,
+            'PCM'
+        )
+        return [(self.__prepare_signal__(store[i]), self.SAMPLE_RATE or store.sample_rates[i]) for store, i in pcm]
+
+    def __pcm_cache_path__(self, name):
+        return os.path.join(self.data_root, 'pcm_{}_{}'.format(name, self.pcm_storage_dtype))
+
+    def __pcm_parameters__(self):
+        return {
+            'sr': self.SAMPLE_RATE,
+            'mono': self.MONO,
+            'librosa': librosa.__version__,
+            'storage_dtype': self.pcm_storage_dtype
+        }
+
+    def __decode_files__(self, files):
+        return map_files(self.__decode_file__, files, num_workers=self.num_extraction_workers)
+
+    def __decode_file__(self, file):
+        x, _ = librosa.load(file, sr=self.SAMPLE_RATE, mono=self.MONO)
+        return x
+
+    def __prepare_signal__(self, x):
+        if self.max_file_length is not None and len(x) > (self.max_file_length + 1 * self.hop_size) + self.n_fft:
+            x = x[:(self.max_file_length + 1) * self.hop_size + self.n_fft]
+        if self.normalize:
+            x = (x - x.mean()) / x.std()
+        return x
+
+    def __load_raw_file__(self, file):
+        x, sr = librosa.load(file, sr=self.SAMPLE_RATE, mono=self.MONO)
+        return self.__prepare_signal__(x), sr
+
+    def __preprocess_signal__(self, signal):
+        x, sr = signal
+        return librosa_log_mel(
+            x, sr, self.n_fft, self.hop_size, self.num_mel, self.power, self.fmin, self.normalize_spec
+        )
+
+    def __load_preprocess_file__(self, file):
+        return self.__preprocess_signal__(self.__load_raw_file__(file))
@@ -0,0 +1,263 @@
+import os
+import sys
+import time
+import zlib
+import threading
+from multiprocessing.connection import Listener, Client
+from dcase2020_task2.data_sets.feature_store import FeatureStore, parse_bytes
+
+# training processes publish their stores via the server listening on this address, if it is set
+ADDRESS_VARIABLE = 'DCASE2020_TASK2_FEATURE_SERVER'
+AUTHKEY = b'dcase2020_task2'
+
+
+class FeatureStoreChanged(Exception):
+    """ The store was rebuilt after the client validated it; the client keeps using the store it opened. """
+
+
+class FeatureServer:
+    """
+    Node-local process that keeps feature stores in shared memory for concurrently running experiments.
+
+    Clients send the path and cache key of a feature store they validated (or built) with load_feature_store. The
+    first request for a store copies its features into root, a tmpfs directory, and every request is answered with the
+    path of that copy. Clients memory-map the copy, so any number of processes share a single, already resident copy of
+    each store. Requests whose key does not match the manifest on disk (the store was rebuilt meanwhile) are rejected
+    with FeatureStoreChanged.
+
+    Copies are reference counted by connection. Once the last client using a copy disconnected, it is kept for
+    keep_seconds (None: until the server stops), so the DataLoader workers of the next epoch, which share lazily opened
+    stores again, find it in place. With max_bytes, unused copies are removed in least recently used order to make
+    room for new ones; stores that still do not fit are not copied, clients are pointed to the store on disk and share
+    it through the page cache. Processes that still map a removed copy keep it alive until they close it.
+
+    Stores are copied outside of the server lock, so a large copy only delays the requests for the same store.
+    """
+
+    def __init__(self, address, root='/dev/shm/dcase2020_task2', max_bytes=None, keep_seconds=600):
+        self.address = address
+        self.root = root
+        self.max_bytes = max_bytes
+        self.keep_seconds = keep_seconds
+        self.published = {}
+        self.lock = threading.Lock()
+        self.path_locks = {}
+        self.stopped = None
+        self.num_connections = 0
+
+    def serve_forever(self):
+        os.makedirs(self.root, exist_ok=True)
+        threading.Thread(target=self.__expire_forever__, daemon=True).start()
+        with Listener(self.address, family='AF_UNIX', authkey=AUTHKEY) as listener:
+            print('Serving features on {}...'.format(self.address))
+            while True:
+                connection = listener.accept()
+                if self.stopped is not None:
+                    connection.close()
+                    break
+                self.num_connections += 1
+                threading.Thread(
+                    target=self.__handle__, args=(connection, self.num_connections), daemon=True
+                ).start()
+        # let the thread that handled the stop request finish
+        self.stopped.join()
+
+        with self.lock:
+            for path in list(self.published):
+                self.__remove__(path)
+
+    def __handle__(self, connection, client):
+        with connection:
+            try:
+                while True:
+                    try:
+                        request = connection.recv()
+                    except EOFError:
+                        return
+                    if request is None:
+                        self.stopped = threading.current_thread()
+                        # the accept loop notices the stop request with the next connection
+                        Client(self.address, family='AF_UNIX', authkey=AUTHKEY).close()
+                        return
+                    try:
+                        connection.send(self.publish(*request, client=client))
+                    except Exception as e:
+                        connection.send(e)
+            finally:
+                self.release(client)
+
+    @property
+    def nbytes(self):
+        return sum(entry['nbytes'] for entry in self.published.values())
+
+    def publish(self, path, key, client=None):
+        """
+        Returns the path of the shared copy of the features of the store at path, whose manifest must hold key; copies
+        them if needed. The copy is kept while client or any other client uses it.
+        """
+        with self.lock:
+            path_lock = self.path_locks.setdefault(path, threading.Lock())
+
+        # requests for one store are serialized, the first one copies it
+        with path_lock:
+            manifest = FeatureStore.open(path).manifest
+            if manifest.get('key') != key:
+                raise FeatureStoreChanged(path)
+
+            with self.lock:
+                entry = self.published.get(path)
+                if entry is not None and entry['key'] != key:
+                    # the store was rebuilt, clients of the previous copy keep their mapping
+                    self.__remove__(path)
+                    entry = None
+
+                if entry is not None:
+                    entry['clients'].add(client)
+                    entry['released'] = None
+                    return entry['shared_path']
+
+                nbytes = os.path.getsize(path + FeatureStore.DATA_SUFFIX)
+                if not self.__make_room__(nbytes):
+                    print('Not publishing {}, {:.1f} MB of {:.1f} MB in use.'.format(
+                        path, self.nbytes / 2 ** 20, self.max_bytes / 2 ** 20
+                    ))
+                    return path + FeatureStore.DATA_SUFFIX
+
+                # reserves the space, the entry is used by client and cannot be removed while it is copied
+                entry = {
+                    'key': key,
+                    'shared_path': os.path.join(self.root, key + FeatureStore.DATA_SUFFIX),
+                    'nbytes': nbytes,
+                    'clients': {client},
+                    'released': None
+                }
+                self.published[path] = entry
+
+            print('Publishing {}...'.format(path))
+            try:
+                self.__copy_file__(
+                    path + FeatureStore.DATA_SUFFIX, entry['shared_path'], manifest.get('checksums', {}).get('data')
+                )
+            except Exception:
+                with self.lock:
+                    self.__remove__(path)
+                raise
+            return entry['shared_path']
+
+    def release(self, client):
+        """ Drops client from all copies; copies no client uses anymore are kept for keep_seconds. """
+        with self.lock:
+            for entry in self.published.values():
+                if client in entry['clients']:
+                    entry['clients'].discard(client)
+                    if len(entry['clients']) == 0:
+                        entry['released'] = time.time()
+
+    def __make_room__(self, nbytes):
+        """ Removes unused copies, least recently released first, until nbytes fit into max_bytes; needs the lock. """
+        if self.max_bytes is None:
+            return True
+        unused = sorted(
+            [(entry['released'], path) for path, entry in self.published.items() if entry['released'] is not None]
+        )
+        for _, path in unused:
+            if self.nbytes + nbytes <= self.max_bytes:
+                break
+            self.__remove__(path)
+        return self.nbytes + nbytes <= self.max_bytes
+
+    def __expire_forever__(self, interval=60):
+        while self.keep_seconds is not None:
+            time.sleep(interval)
+            with self.lock:
+                for path, entry in list(self.published.items()):
+                    if entry['released'] is not None and time.time() - entry['released'] > self.keep_seconds:
+                        self.__remove__(path)
+
+    def __remove__(self, path):
+        entry = self.published.pop(path)
+        for file in [entry['shared_path'], entry['shared_path'] + '.tmp']:
+            if os.path.exists(file):
+                os.remove(file)
+
+    @staticmethod
+    def __copy_file__(source, destination, expected_checksum, chunk_size=2 ** 24):
+        """ Copies source and verifies its checksum on the way, the features are read only once. """
+        crc = 0
+        with open(source, 'rb') as f, open(destination + '.tmp', 'wb') as g:
+            chunk = f.read(chunk_size)
+            while chunk:
+                crc = zlib.crc32(chunk, crc)
+                g.write(chunk)
+                chunk = f.read(chunk_size)
+        if expected_checksum is not None and crc != expected_checksum:
+            os.remove(destination + '.tmp')
+            raise IOError('Checksum mismatch: {}'.format(source))
+        os.replace(destination + '.tmp', destination)
+
+
+class FeatureServerClient:
+
+    def __init__(self, address):
+        self.connection = Client(address, family='AF_UNIX', authkey=AUTHKEY)
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def share(self, store):
+        """ Returns store re-opened on the shared copy of its features; FeatureStoreChanged if it was rebuilt. """
+        key = store.manifest.get('key')
+        with self.lock:
+            self.connection.send((store.path, key))
+            response = self.connection.recv()
+        if isinstance(response, Exception):
+            raise response
+        shared = FeatureStore.open(store.path, data_path=response)
+        # index and manifest are read from disk again, they must belong to the features of the copy
+        if shared.manifest.get('key') != key:
+            raise FeatureStoreChanged(store.path)
+        return shared
+
+    def stop(self):
+        self.connection.send(None)
+
+
+CLIENT = None
+
+
+def share_feature_store(store):
+    """
+    Returns store backed by the shared copy of the feature server at $DCASE2020_TASK2_FEATURE_SERVER; returns store
+    unchanged if the variable is not set or the server is not reachable.
+    """
+    global CLIENT
+    address = os.environ.get(ADDRESS_VARIABLE)
+    if address is None:
+        return store
+
+    # connections must not be shared with forked processes
+    if CLIENT is None or CLIENT.pid != os.getpid():
+        try:
+            CLIENT = FeatureServerClient(address)
+        except OSError:
+            print('Feature server {} not reachable, using {}.'.format(address, store.path))
+            return store
+
+    try:
+        return CLIENT.share(store)
+    except FeatureStoreChanged:
+        print('{} changed since it was opened, not sharing it.'.format(store.path))
+        return store
+
+
+if __name__ == '__main__':
+
+    # python -m dcase2020_task2.data_sets.feature_server <address> [max bytes, e.g. 64G | none] [keep seconds | none]
+    # python -m dcase2020_task2.data_sets.feature_server <address> stop
+    if len(sys.argv) > 2 and sys.argv[2] == 'stop':
+        FeatureServerClient(sys.argv[1]).stop()
+    else:
+        FeatureServer(
+            sys.argv[1],
+            max_bytes=parse_bytes(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2] != 'none' else None,
+            keep_seconds=(None if sys.argv[3] == 'none' else float(sys.argv[3])) if len(sys.argv) > 3 else 600
+        ).serve_forever()
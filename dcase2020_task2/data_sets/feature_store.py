@@ -0,0 +1,637 @@
+import os
+import sys
+import time
+import json
+import zlib
+import fcntl
+import zipfile
+import hashlib
+import threading
+import collections
+import numpy as np
+import soundfile
+from dcase2020_task2.data_sets.statistics import RunningStatistics
+
+
+class FeatureStore:
+    """
+    On-disk container for the spectrograms of one data set.
+
+    All files are concatenated along the time axis into one contiguous, time-major array (frames x feature dims),
+    which is opened as a read-only memory map. The index holds the frame offset of every file and its feature shape,
+    so windows can be sliced without reading the whole data set into memory. The manifest records the feature
+    parameters, the signatures of the source files the store was built from (see cache_key) and their audio meta
+    data (sample rate, channels, samples), so no audio has to be decoded when a store is opened.
+
+    Features are stored as float32, float16, uint8 or int16 (see STORAGE_DTYPES). uint8 stores are quantized per file
+    with the scale and shift kept in the index; int16 stores hold PCM samples in [-1, 1) at full scale. Windows are
+    always returned as dequantized float32 arrays.
+
+    The memory map is backed by the page cache, so all processes reading a store (forked DataLoader workers inherit
+    the map, spawned ones re-open it, see __reduce__) share one read-only copy of the features.
+    """
+
+    DATA_SUFFIX = '.features.npy'
+    INDEX_SUFFIX = '.index.npz'
+    MANIFEST_SUFFIX = '.manifest.json'
+    STATISTICS_SUFFIX = '.statistics.npz'
+    LOCK_SUFFIX = '.lock'
+    USE_SUFFIX = '.use.lock'
+    ACCESS_SUFFIX = '.access.json'
+    SUFFIXES = [DATA_SUFFIX, INDEX_SUFFIX, MANIFEST_SUFFIX, STATISTICS_SUFFIX, ACCESS_SUFFIX, LOCK_SUFFIX, USE_SUFFIX]
+    # lock files stay in place, removing them would split the processes locking them
+    LOCK_SUFFIXES = [LOCK_SUFFIX, USE_SUFFIX]
+
+    STORAGE_DTYPES = {
+        'float32': np.float32,
+        'float16': np.float16,
+        'uint8': np.uint8,
+        'int16': np.int16
+    }
+
+    def __init__(self, path, data, offsets, feature_shape, scales=None, shifts=None, manifest=None, data_path=None):
+        self.path = path
+        self.data_path = data_path if data_path is not None else path + self.DATA_SUFFIX
+        self.data = data
+        self.offsets = offsets
+        self.lengths = np.diff(offsets)
+        self.feature_shape = tuple(feature_shape)
+        self.scales = scales
+        self.shifts = shifts
+        self.manifest = manifest if manifest is not None else {}
+
+    @property
+    def quantized(self):
+        return self.scales is not None
+
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(path + cls.DATA_SUFFIX) and os.path.exists(path + cls.INDEX_SUFFIX)
+
+    @classmethod
+    def open(cls, path, data_path=None):
+        """ Opens the store at path; the features can be mapped from a copy at data_path (see FeatureServer). """
+        data_path = data_path if data_path is not None else path + cls.DATA_SUFFIX
+        data = np.load(data_path, mmap_mode='r')
+        with np.load(path + cls.INDEX_SUFFIX) as index:
+            offsets = index['offsets']
+            feature_shape = index['feature_shape']
+            scales = index['scales'] if 'scales' in index else None
+            shifts = index['shifts'] if 'shifts' in index else None
+        manifest = None
+        if os.path.exists(path + cls.MANIFEST_SUFFIX):
+            with open(path + cls.MANIFEST_SUFFIX, 'r') as f:
+                manifest = json.load(f)
+        return cls(
+            path, data, offsets, feature_shape, scales=scales, shifts=shifts, manifest=manifest, data_path=data_path
+        )
+
+    @classmethod
+    def read_lengths(cls, path):
+        """ Returns the number of frames per file from the index alone, without opening the data or manifest. """
+        with np.load(path + cls.INDEX_SUFFIX) as index:
+            return np.diff(index['offsets'])
+
+    @classmethod
+    def read_key(cls, path):
+        """
+        Returns the cache key of the store at path from its manifest alone, or None if there is no complete store
+        (see load_feature_store for what is accepted as valid).
+        """
+        if not cls.exists(path) or not os.path.exists(path + cls.MANIFEST_SUFFIX):
+            return None
+        try:
+            with open(path + cls.MANIFEST_SUFFIX, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return manifest.get('key') if 'audio' in manifest else None
+
+    @classmethod
+    def write(cls, path, arrays, storage_dtype='float32', manifest=None):
+        """ Writes a list of (..., frames) arrays with identical leading dimensions and returns the opened store. """
+        assert len(arrays) > 0
+        feature_shape = arrays[0].shape[:-1]
+        assert all(a.shape[:-1] == feature_shape for a in arrays)
+        dtype = cls.STORAGE_DTYPES[storage_dtype]
+
+        lengths = np.array([a.shape[-1] for a in arrays], dtype=np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+
+        # everything is written to temporary files first, see __commit__
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        data = np.lib.format.open_memmap(
+            temporary + cls.DATA_SUFFIX,
+            mode='w+',
+            dtype=dtype,
+            shape=(int(offsets[-1]),) + feature_shape
+        )
+        index = {}
+        if dtype in [np.uint8, np.int16]:
+            index['scales'] = np.ones(len(arrays), dtype=np.float32)
+            index['shifts'] = np.zeros(len(arrays), dtype=np.float32)
+        for i, a in enumerate(arrays):
+            a = np.moveaxis(a, -1, 0)
+            if dtype == np.uint8:
+                low, high = float(a.min()), float(a.max())
+                scale = (high - low) / 255 if high > low else 1.0
+                index['scales'][i], index['shifts'][i] = scale, low
+                a = np.round((a - low) / scale)
+            elif dtype == np.int16:
+                # lossless for 16 bit audio files
+                index['scales'][i] = 2 ** -15
+                a = np.clip(np.round(a * 2 ** 15), -2 ** 15, 2 ** 15 - 1)
+            data[offsets[i]:offsets[i + 1]] = a
+        data.flush()
+        del data
+
+        with open(temporary + cls.INDEX_SUFFIX, 'wb') as f:
+            np.savez(
+                f,
+                offsets=offsets,
+                feature_shape=np.array(feature_shape, dtype=np.int64),
+                **index
+            )
+
+        manifest = dict(manifest) if manifest is not None else {}
+        manifest['checksums'] = {
+            'data': checksum(temporary + cls.DATA_SUFFIX),
+            'index': checksum(temporary + cls.INDEX_SUFFIX)
+        }
+        with open(temporary + cls.MANIFEST_SUFFIX, 'w') as f:
+            json.dump(manifest, f)
+
+        cls.__commit__(temporary, path)
+        return cls.open(path)
+
+    @classmethod
+    def __commit__(cls, temporary, path):
+        """
+        Renames the files of the store written to temporary into place. The manifest, which holds the cache key, is
+        removed first and replaced last, so an interrupted commit leaves a store that is rebuilt instead of a store
+        whose parts do not belong together. Processes that still map the previous data keep reading it.
+        """
+        if os.path.exists(path + cls.MANIFEST_SUFFIX):
+            os.remove(path + cls.MANIFEST_SUFFIX)
+        for suffix in [cls.DATA_SUFFIX, cls.INDEX_SUFFIX, cls.MANIFEST_SUFFIX]:
+            os.replace(temporary + suffix, path + suffix)
+
+    def verify(self, full=False):
+        """
+        Compares the checksums recorded in the manifest with the files on disk. The index is always checked, the
+        features (which requires reading them completely) only if full is set.
+        """
+        checksums = self.manifest.get('checksums')
+        if checksums is None:
+            # written before checksums were recorded
+            return True
+        if checksum(self.path + self.INDEX_SUFFIX) != checksums['index']:
+            return False
+        if full and checksum(self.data_path) != checksums['data']:
+            return False
+        return True
+
+    def window(self, file_idx, offset, length):
+        """ Returns a dequantized (..., length) float32 copy of file file_idx starting at frame offset. """
+        start = self.offsets[file_idx] + offset
+        x = np.moveaxis(self.data[start:start + length], 0, -1).astype(np.float32)
+        if self.quantized:
+            x *= self.scales[file_idx]
+            x += self.shifts[file_idx]
+        return x
+
+    def windows(self, file_indices, offsets, length, out=None):
+        """
+        Gathers one window per (file index, offset) pair with a single fancy-indexing read and returns them as
+        dequantized (batch, ..., length) float32 array; out can be a preallocated array of that shape.
+        """
+        starts = self.offsets[file_indices] + offsets
+        x = np.moveaxis(self.data[starts[:, None] + np.arange(length)], 1, -1)
+        if out is None:
+            out = np.empty(x.shape, dtype=np.float32)
+        out[...] = x
+        if self.quantized:
+            shape = (-1,) + (1,) * (out.ndim - 1)
+            out *= self.scales[file_indices].reshape(shape)
+            out += self.shifts[file_indices].reshape(shape)
+        return out
+
+    def frames(self, start_file, end_file):
+        """ Returns the dequantized, time-major frames of files start_file to end_file (exclusive). """
+        x = self.data[self.offsets[start_file]:self.offsets[end_file]].astype(np.float32)
+        if self.quantized:
+            shape = (-1,) + (1,) * len(self.feature_shape)
+            lengths = self.lengths[start_file:end_file]
+            x *= np.repeat(self.scales[start_file:end_file], lengths).reshape(shape)
+            x += np.repeat(self.shifts[start_file:end_file], lengths).reshape(shape)
+        return x
+
+    def statistics(self, chunk_size=2 ** 16):
+        """
+        Per-bin statistics over all frames, computed in a single pass over chunks of about chunk_size frames and
+        stored next to the cache; recomputed whenever the cache key changes.
+        """
+        path = self.path + self.STATISTICS_SUFFIX
+        key = self.manifest.get('key', '')
+        if os.path.exists(path):
+            with np.load(path) as state:
+                if str(state['key']) == key:
+                    return RunningStatistics.from_state_dict(state)
+
+        statistics = RunningStatistics(self.feature_shape)
+        start = 0
+        while start < len(self):
+            end = int(np.searchsorted(self.offsets, self.offsets[start] + chunk_size, side='right')) - 1
+            end = min(max(end, start + 1), len(self))
+            statistics.update(self.frames(start, end))
+            start = end
+
+        temporary = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temporary, 'wb') as f:
+            np.savez(f, key=key, **statistics.state_dict())
+        os.replace(temporary, path)
+        return statistics
+
+    def __getitem__(self, file_idx):
+        return self.window(file_idx, 0, self.offsets[file_idx + 1] - self.offsets[file_idx])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    @property
+    def sample_rates(self):
+        return [a[0] for a in self.manifest['audio']]
+
+    @property
+    def num_channels(self):
+        return [a[1] for a in self.manifest['audio']]
+
+    def __reduce__(self):
+        # re-open the memory map instead of pickling its content (e.g. for spawned DataLoader workers)
+        return FeatureStore.open, (self.path, self.data_path)
+
+
+def file_signatures(files):
+    """ Returns a (path, size, modification time) triple per file. """
+    signatures = []
+    for f in files:
+        stat = os.stat(f)
+        signatures.append([f, stat.st_size, stat.st_mtime_ns])
+    return signatures
+
+
+def audio_info(file):
+    """ Returns [sample rate, channels, samples] of an audio file; reads the header only. """
+    info = soundfile.info(file)
+    return [info.samplerate, info.channels, info.frames]
+
+
+def checksum(file, chunk_size=2 ** 24):
+    """ CRC32 of the content of file, read in chunks of chunk_size bytes. """
+    crc = 0
+    with open(file, 'rb') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            crc = zlib.crc32(chunk, crc)
+            chunk = f.read(chunk_size)
+    return crc
+
+
+class FileLock:
+    """
+    Lock on a lock file, shared by all processes of a node (fcntl.flock); released on exit of the with block, by
+    release or when the holding process dies. Locks are exclusive unless shared is set: any number of shared locks can
+    be held together, but not together with an exclusive one. Without blocking, acquiring raises BlockingIOError if
+    the lock is held.
+    """
+
+    def __init__(self, path, blocking=True, shared=False):
+        self.path = path
+        self.blocking = blocking
+        self.shared = shared
+        self.file = None
+
+    def acquire(self):
+        self.file = open(self.path, 'a')
+        operation = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        try:
+            fcntl.flock(self.file, operation | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if not self.blocking:
+                self.file.close()
+                self.file = None
+                raise
+            print('Waiting for {}...'.format(self.path))
+            fcntl.flock(self.file, operation)
+        return self
+
+    def release(self):
+        if self.file is None:
+            return
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *args):
+        self.release()
+
+    def __getstate__(self):
+        # the lock is held by the process that acquired it (and its forks), not by unpickled copies
+        return dict(self.__dict__, file=None)
+
+
+def use_feature_store(path):
+    """
+    Returns a shared lock on the store at path, which keeps FeatureCache.prune from removing it, e.g. while DataLoader
+    workers open it. Data sets hold it as long as they exist; it is released when they are garbage collected.
+    """
+    return FileLock(path + FeatureStore.USE_SUFFIX, shared=True).acquire()
+
+
+def cache_key(parameters, signatures):
+    """ Hash of the feature parameters and the source file signatures; changes whenever a store becomes stale. """
+    content = json.dumps([parameters, signatures], sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def load_feature_store(path, files, parameters, extract, description, storage_dtype='float32', signatures=None):
+    """
+    Opens the store at path if its manifest matches files and parameters and its index checksum is valid. Otherwise
+    the store is rebuilt: features of files whose signature did not change are copied from the previous store (if it
+    was built with the same parameters), all other files are passed to extract, which maps a list of files to a list
+    of feature arrays. signatures are taken from the file system if not given (e.g. by a FileIndex).
+
+    Processes loading the same store are serialized by a lock file next to it, so a store is built by the first
+    process only and the others wait and open the result.
+    """
+    if signatures is None:
+        signatures = file_signatures(files)
+    key = cache_key(parameters, signatures)
+
+    with FileLock(path + FeatureStore.LOCK_SUFFIX):
+        previous = None
+        if FeatureStore.exists(path):
+            try:
+                previous = FeatureStore.open(path)
+            except (OSError, ValueError, zipfile.BadZipFile):
+                pass
+            if previous is None or not previous.verify():
+                print('Discarding damaged {}...'.format(path))
+                previous = None
+
+        cache = FeatureCache(os.path.dirname(path))
+        if previous is not None and previous.manifest.get('key') == key and 'audio' in previous.manifest:
+            print('Loading {}...'.format(description))
+            cache.touch(path, hit=True)
+            return previous
+
+        reusable = {}
+        if previous is not None and previous.manifest.get('parameters') == parameters \
+                and 'audio' in previous.manifest:
+            for i, signature in enumerate(previous.manifest['files']):
+                reusable[tuple(signature)] = i
+
+        data = [None] * len(files)
+        audio = [None] * len(files)
+        missing = []
+        for i, signature in enumerate(signatures):
+            if tuple(signature) in reusable:
+                data[i] = previous[reusable[tuple(signature)]]
+                audio[i] = previous.manifest['audio'][reusable[tuple(signature)]]
+            else:
+                missing.append(i)
+        del previous
+
+        if len(missing) < len(files):
+            print('Updating {} ({} of {} files changed)...'.format(description, len(missing), len(files)))
+        else:
+            print('Loading & Saving {}...'.format(description))
+
+        for i, x in zip(missing, extract([files[i] for i in missing])):
+            data[i] = x
+            audio[i] = audio_info(files[i])
+
+        manifest = {
+            'key': key,
+            'parameters': parameters,
+            'files': signatures,
+            'audio': audio
+        }
+        store = FeatureStore.write(path, data, storage_dtype=storage_dtype, manifest=manifest)
+        cache.touch(path, hit=False)
+        cache.prune(keep=[path])
+        return store
+
+
+class FeatureRegistry:
+    """
+    Process-wide registry of opened feature stores, keyed by cache path.
+
+    Data sets acquire stores on construction and release them when they are garbage collected. Stores that are no
+    longer referenced stay cached until the registry exceeds max_bytes; they are then evicted in least-recently-used
+    order.
+    """
+
+    def __init__(self, max_bytes=32 * 2 ** 30):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.reference_counts = {}
+        self.lock = threading.RLock()
+
+    def acquire(self, key, load):
+        """ Returns the entry for key and increments its reference count; calls load() if it is not cached. """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            else:
+                self.entries[key] = load()
+                self.reference_counts[key] = 0
+            self.reference_counts[key] += 1
+            entry = self.entries[key]
+            self.__evict__()
+            return entry
+
+    def release(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return
+            self.reference_counts[key] = max(0, self.reference_counts[key] - 1)
+            self.__evict__()
+
+    def clear(self):
+        with self.lock:
+            for key in [k for k in self.entries if self.reference_counts[k] == 0]:
+                self.__remove__(key)
+
+    @property
+    def nbytes(self):
+        return sum(entry.nbytes for entry in self.entries.values())
+
+    def __evict__(self):
+        total = self.nbytes
+        for key in list(self.entries):
+            if total <= self.max_bytes:
+                break
+            if self.reference_counts[key] == 0:
+                total -= self.entries[key].nbytes
+                self.__remove__(key)
+
+    def __remove__(self, key):
+        del self.entries[key]
+        del self.reference_counts[key]
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+FEATURE_REGISTRY = FeatureRegistry()
+
+
+class FeatureCache:
+    """
+    Manages the feature stores in one directory (e.g. a data root) as a cache with an optional byte budget.
+
+    Every load of a store through load_feature_store is recorded in an access file next to it: its modification time
+    is the time of the last access, its content the number of hits (store was valid) and misses (store had to be
+    built or updated). Whenever a store is written, the least recently used stores are removed until the directory
+    fits into max_bytes, which is kept in the CONFIG_FILE of the directory (unbounded if not set). Stores that are
+    being loaded or are used by a data set of any process (see use_feature_store) are skipped.
+    """
+
+    CONFIG_FILE = 'feature_cache.json'
+
+    def __init__(self, root):
+        self.root = root
+
+    @property
+    def max_bytes(self):
+        path = os.path.join(self.root, FeatureCache.CONFIG_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f).get('max_bytes')
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes):
+        path = os.path.join(self.root, FeatureCache.CONFIG_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'max_bytes': max_bytes}, f)
+        os.replace(path + '.tmp', path)
+
+    def touch(self, path, hit):
+        """ Records an access of the store at path; callers hold the lock of the store. """
+        usage = self.__usage__(path)
+        usage['hits' if hit else 'misses'] += 1
+        with open(path + FeatureStore.ACCESS_SUFFIX, 'w') as f:
+            json.dump(usage, f)
+
+    def entries(self):
+        """ Returns one dict (path, nbytes, last_access, hits, misses) per store, least recently used first. """
+        entries = []
+        for name in os.listdir(self.root):
+            if not name.endswith(FeatureStore.MANIFEST_SUFFIX):
+                continue
+            path = os.path.join(self.root, name[:-len(FeatureStore.MANIFEST_SUFFIX)])
+            # files of a store that is being written by FeatureStore.write
+            if path.endswith('.tmp'):
+                continue
+            files = [path + suffix for suffix in FeatureStore.SUFFIXES if os.path.exists(path + suffix)]
+            access = path + FeatureStore.ACCESS_SUFFIX
+            if not os.path.exists(access):
+                access = path + FeatureStore.MANIFEST_SUFFIX
+            entry = {
+                'path': path,
+                'nbytes': sum(os.path.getsize(f) for f in files),
+                'last_access': os.path.getmtime(access)
+            }
+            entry.update(self.__usage__(path))
+            entries.append(entry)
+        return sorted(entries, key=lambda e: e['last_access'])
+
+    def prune(self, max_bytes=None, keep=()):
+        """ Removes least recently used stores (except keep) until at most max_bytes (default: budget) are used. """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if max_bytes is None:
+            return []
+
+        entries = self.entries()
+        total = sum(e['nbytes'] for e in entries)
+        removed = []
+        for entry in entries:
+            if total <= max_bytes:
+                break
+            if entry['path'] in keep:
+                continue
+            try:
+                with FileLock(entry['path'] + FeatureStore.LOCK_SUFFIX, blocking=False), \
+                        FileLock(entry['path'] + FeatureStore.USE_SUFFIX, blocking=False):
+                    print('Evicting {} ({:.1f} MB)...'.format(entry['path'], entry['nbytes'] / 2 ** 20))
+                    for suffix in FeatureStore.SUFFIXES:
+                        if suffix not in FeatureStore.LOCK_SUFFIXES and os.path.exists(entry['path'] + suffix):
+                            os.remove(entry['path'] + suffix)
+            except BlockingIOError:
+                continue
+            total -= entry['nbytes']
+            removed.append(entry)
+        return removed
+
+    @staticmethod
+    def __usage__(path):
+        access = path + FeatureStore.ACCESS_SUFFIX
+        if os.path.exists(access):
+            with open(access, 'r') as f:
+                return json.load(f)
+        return {'hits': 0, 'misses': 0}
+
+
+def parse_bytes(size):
+    """ Parses sizes like 500M, 20G or 1T (binary units) into bytes. """
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+    if size[-1].upper() in units:
+        return int(float(size[:-1]) * units[size[-1].upper()])
+    return int(size)
+
+
+if __name__ == '__main__':
+
+    # python -m dcase2020_task2.data_sets.feature_store <directory> list
+    # python -m dcase2020_task2.data_sets.feature_store <directory> prune [max bytes, e.g. 100G]
+    # python -m dcase2020_task2.data_sets.feature_store <directory> budget <max bytes | none>
+    cache = FeatureCache(sys.argv[1])
+    command = sys.argv[2] if len(sys.argv) > 2 else 'list'
+
+    if command == 'list':
+        entries = cache.entries()
+        for e in entries:
+            print('{:>10.1f} MB {:>6} hits {:>4} misses  {}  {}'.format(
+                e['nbytes'] / 2 ** 20,
+                e['hits'],
+                e['misses'],
+                time.strftime('%Y-%m-%d %H:%M', time.localtime(e['last_access'])),
+                os.path.basename(e['path'])
+            ))
+        budget = cache.max_bytes
+        print('{} stores, {:.1f} MB of {}, {} hits, {} misses'.format(
+            len(entries),
+            sum(e['nbytes'] for e in entries) / 2 ** 20,
+            'unbounded' if budget is None else '{:.1f} MB'.format(budget / 2 ** 20),
+            sum(e['hits'] for e in entries),
+            sum(e['misses'] for e in entries)
+        ))
+    elif command == 'prune':
+        removed = cache.prune(max_bytes=parse_bytes(sys.argv[3]) if len(sys.argv) > 3 else None)
+        print('Removed {} stores ({:.1f} MB).'.format(len(removed), sum(e['nbytes'] for e in removed) / 2 ** 20))
+    elif command == 'budget':
+        cache.max_bytes = None if sys.argv[3] == 'none' else parse_bytes(sys.argv[3])
+    else:
+        raise AttributeError
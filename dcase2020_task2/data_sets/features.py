@@ -0,0 +1,157 @@
+import os
+import inspect
+import functools
+import multiprocessing
+import numpy as np
+import librosa
+import torch
+
+TOP_DB = 80.0
+
+# torch.stft only returns complex tensors in newer versions of PyTorch
+_STFT_RETURN_COMPLEX = 'return_complex' in inspect.signature(torch.stft).parameters
+# librosa pads centered frames with zeros since version 0.10 (before: reflect)
+PAD_MODE = inspect.signature(librosa.feature.melspectrogram).parameters['pad_mode'].default
+
+
+def map_files(function, files, num_workers=None):
+    """
+    Applies function to every file and returns the results in the order of files.
+    Uses a process pool with num_workers processes (default: all cores); falls back to serial execution for a single
+    worker. function must be picklable, i.e. a module level function, a functools.partial or a bound method.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(files))
+
+    if num_workers <= 1:
+        return [function(f) for f in files]
+
+    # a few chunks per worker balance the load while keeping the pickling overhead low
+    chunk_size = max(1, len(files) // (num_workers * 4))
+    with multiprocessing.Pool(processes=num_workers) as pool:
+        return pool.map(function, files, chunksize=chunk_size)
+
+
+def librosa_log_mel(x, sr, n_fft, hop_size, num_mel, power, fmin, normalize_spec):
+    """ Log-mel spectrogram of a single signal, shape (num_mel, frames). """
+    x = librosa.feature.melspectrogram(
+        y=x,
+        sr=sr,
+        n_fft=n_fft,
+        hop_length=hop_size,
+        n_mels=num_mel,
+        power=power,
+        fmin=fmin
+    )
+
+    if power == 1:
+        x = librosa.core.amplitude_to_db(x)
+    elif power == 2:
+        x = librosa.core.power_to_db(x)
+    else:
+        raise AttributeError
+
+    if normalize_spec:
+        x = (x - x.mean(axis=-1, keepdims=True)) / x.std(axis=-1, keepdims=True)
+
+    return x
+
+
+@functools.lru_cache(maxsize=16)
+def mel_filterbank(sr, n_fft, num_mel, fmin):
+    return torch.from_numpy(librosa.filters.mel(sr=sr, n_fft=n_fft, n_mels=num_mel, fmin=fmin).astype(np.float32))
+
+
+@functools.lru_cache(maxsize=16)
+def hann_window(n_fft):
+    return torch.hann_window(n_fft, periodic=True)
+
+
+def stft_power(x, n_fft, hop_size):
+    """ Power spectrogram |STFT|^2 of a batch of signals (centered as librosa.stft, periodic Hann window). """
+    window = hann_window(n_fft)
+    if _STFT_RETURN_COMPLEX:
+        s = torch.stft(
+            x, n_fft, hop_length=hop_size, window=window, center=True, pad_mode=PAD_MODE, return_complex=True
+        )
+        return s.real ** 2 + s.imag ** 2
+    s = torch.stft(x, n_fft, hop_length=hop_size, window=window, center=True, pad_mode=PAD_MODE)
+    return s.pow(2).sum(-1)
+
+
+def power_to_log_mel(s, mel_basis, power, normalize_spec):
+    """ Applies mel projection of |S| ** power, dB conversion and top_db=80 per signal to a batch of spectrograms. """
+    if power == 1:
+        s = s.sqrt()
+    s = torch.matmul(mel_basis, s)
+
+    # amplitude_to_db(S) == power_to_db(S ** 2), both with ref=1.0
+    if power == 1:
+        s = 20.0 * torch.log10(torch.clamp(s, min=1e-5))
+    else:
+        s = 10.0 * torch.log10(torch.clamp(s, min=1e-10))
+    peak = s.reshape(len(s), -1).max(dim=1)[0]
+    s = torch.max(s, (peak - TOP_DB).reshape((-1,) + (1,) * (s.dim() - 1)))
+
+    if normalize_spec:
+        s = (s - s.mean(dim=-1, keepdim=True)) / s.std(dim=-1, unbiased=False, keepdim=True)
+    return s
+
+
+def map_batches(function, arrays, batch_size):
+    """ Applies function to stacks of up to batch_size arrays of equal shape and returns the results in order. """
+    groups = {}
+    for i, x in enumerate(arrays):
+        groups.setdefault(x.shape, []).append(i)
+
+    results = [None] * len(arrays)
+    with torch.no_grad():
+        for indices in groups.values():
+            for start in range(0, len(indices), batch_size):
+                batch_indices = indices[start:start + batch_size]
+                x = torch.from_numpy(np.stack([arrays[i] for i in batch_indices]).astype(np.float32))
+                for i, y in zip(batch_indices, function(x).numpy()):
+                    results[i] = y
+    return results
+
+
+def torch_log_mel(signals, sr, n_fft, hop_size, num_mel, power, fmin, normalize_spec, batch_size=64):
+    """
+    Batched equivalent of librosa_log_mel for a list of signals with the same sample rate.
+
+    Signals of equal length are stacked and transformed together (STFT, mel projection with a cached filterbank,
+    dB conversion with top_db=80 per signal). Results match librosa_log_mel (including the padding of the installed
+    librosa version) up to float32 rounding; the documented tolerance is an absolute deviation of 1e-3 (dB or
+    normalized units), measured deviations on 10 second clips are around 1e-5.
+    """
+    if power not in [1, 2]:
+        raise AttributeError
+
+    mel_basis = mel_filterbank(sr, n_fft, num_mel, fmin)
+    return map_batches(
+        lambda x: power_to_log_mel(stft_power(x, n_fft, hop_size), mel_basis, power, normalize_spec),
+        signals,
+        batch_size
+    )
+
+
+def torch_stft_magnitude(signals, n_fft, hop_size, batch_size=64):
+    """ Linear STFT magnitudes (..., n_fft // 2 + 1, frames) of a list of signals, see log_mel_from_magnitude. """
+    return map_batches(lambda x: stft_power(x, n_fft, hop_size).sqrt(), signals, batch_size)
+
+
+def log_mel_from_magnitude(magnitudes, sr, n_fft, num_mel, power, fmin, normalize_spec, batch_size=64):
+    """
+    Log-mel spectrograms computed from STFT magnitudes as returned by torch_stft_magnitude; the mel front end
+    (num_mel, fmin, power, normalize_spec) can be changed without decoding and transforming the audio again.
+    """
+    if power not in [1, 2]:
+        raise AttributeError
+
+    mel_basis = mel_filterbank(sr, n_fft, num_mel, fmin)
+    return map_batches(
+        lambda x: power_to_log_mel(x ** 2, mel_basis, power, normalize_spec),
+        magnitudes,
+        batch_size
+    )
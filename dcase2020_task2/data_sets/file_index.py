@@ -0,0 +1,184 @@
+import os
+import sys
+import functools
+import numpy as np
+import soundfile
+from dcase2020_task2.data_sets import CLASS_MAP
+from dcase2020_task2.data_sets.feature_store import FileLock, file_signatures
+
+
+class FileIndex:
+    """
+    Table of all audio files below a DCASE data root (dev_data/eval_data/<machine type>/<split>/*.wav).
+
+    Every file is recorded with its path relative to the data root, machine type, id, split ('train' or 'test'),
+    label (0 normal, 1 anomaly, -1 unknown), size, modification time and audio meta data (sample rate, channels,
+    samples). The table is saved next to the data and sorted by path, so data sets can select their files with a mask
+    instead of globbing and parsing file names. The row of a file is the int32 file id that batches carry in
+    'file_ids'.
+
+    The modification time and number of files of every folder are recorded as well. load compares them with the
+    folders on disk and re-indexes folders in which files were added, removed or renamed; files modified in place are
+    caught by signatures, which stats the selected files.
+    """
+
+    FILE_NAME = 'file_index.npz'
+
+    COLUMNS = [
+        'paths', 'machine_types', 'machine_ids', 'splits', 'targets', 'sizes', 'mtimes', 'sample_rates', 'channels',
+        'samples'
+    ]
+    FOLDER_COLUMNS = ['folders', 'folder_mtimes', 'folder_counts']
+
+    def __init__(self, data_root, columns):
+        self.data_root = data_root
+        for key in FileIndex.COLUMNS + FileIndex.FOLDER_COLUMNS:
+            setattr(self, key, columns[key])
+
+    @classmethod
+    def path(cls, data_root):
+        return os.path.join(data_root, cls.FILE_NAME)
+
+    @staticmethod
+    def scan_folders(data_root):
+        """ Returns {folder: (modification time, number of wav files)} of all machine type/split folders. """
+        folders = {}
+        for root_folder in ['dev_data', 'eval_data']:
+            for machine_type in sorted(CLASS_MAP):
+                for split in ['train', 'test']:
+                    folder = os.path.join(root_folder, machine_type, split)
+                    if not os.path.isdir(os.path.join(data_root, folder)):
+                        continue
+                    # taken before listing, a folder changed meanwhile is re-indexed by the next load
+                    mtime = os.stat(os.path.join(data_root, folder)).st_mtime_ns
+                    count = sum(1 for e in os.scandir(os.path.join(data_root, folder)) if e.name.endswith('.wav'))
+                    folders[folder] = (mtime, count)
+        return folders
+
+    def recorded_folders(self):
+        return {str(f): (int(m), int(c)) for f, m, c in zip(self.folders, self.folder_mtimes, self.folder_counts)}
+
+    @classmethod
+    def build(cls, data_root, previous=None):
+        """
+        Scans data_root, reads the header of every file and saves the table. Rows of folders that did not change since
+        previous was built are taken from previous.
+        """
+        folders = cls.scan_folders(data_root)
+        recorded = previous.recorded_folders() if previous is not None else {}
+
+        rows = []
+        for folder in sorted(folders):
+            if recorded.get(folder) == folders[folder]:
+                rows += previous.__rows__(folder)
+                continue
+            for entry in os.scandir(os.path.join(data_root, folder)):
+                if entry.name.endswith('.wav'):
+                    rows.append(cls.__parse__(data_root, os.path.join(folder, entry.name), entry.stat()))
+
+        assert len(rows) > 0
+        rows = sorted(rows, key=lambda r: r[0])
+        columns = {key: np.array([r[i] for r in rows]) for i, key in enumerate(FileIndex.COLUMNS)}
+        columns['folders'] = np.array(sorted(folders))
+        columns['folder_mtimes'] = np.array([folders[f][0] for f in sorted(folders)], dtype=np.int64)
+        columns['folder_counts'] = np.array([folders[f][1] for f in sorted(folders)], dtype=np.int64)
+
+        path = cls.path(data_root)
+        temporary = '{}.{}.tmp.npz'.format(path, os.getpid())
+        np.savez(temporary, **columns)
+        os.replace(temporary, path)
+        return cls(data_root, columns)
+
+    def __rows__(self, folder):
+        selected = np.nonzero(np.char.startswith(self.paths.astype(str), folder + os.sep))[0]
+        return [[getattr(self, key)[i].item() for key in FileIndex.COLUMNS] for i in selected]
+
+    @staticmethod
+    def __parse__(data_root, path, stat):
+        machine_type, split, file_name = path.split(os.sep)[-3:]
+        meta_data = file_name.split('_')
+        if len(meta_data) == 4:
+            if meta_data[0] == 'normal':
+                y = 0
+            elif meta_data[0] == 'anomaly':
+                y = 1
+            else:
+                raise AttributeError
+            machine_id = int(meta_data[2])
+        elif len(meta_data) == 3:
+            y = -1
+            machine_id = int(meta_data[1])
+        else:
+            raise AttributeError
+        info = soundfile.info(os.path.join(data_root, path))
+        return [
+            path, CLASS_MAP[machine_type], machine_id, split, y, stat.st_size, stat.st_mtime_ns, info.samplerate,
+            info.channels, info.frames
+        ]
+
+    @classmethod
+    def read(cls, data_root):
+        """ Reads the saved table; returns None if there is none or it predates the folder columns. """
+        path = cls.path(data_root)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as columns:
+            if any(key not in columns for key in FileIndex.FOLDER_COLUMNS):
+                return None
+            return cls(data_root, {key: columns[key] for key in FileIndex.COLUMNS + FileIndex.FOLDER_COLUMNS})
+
+    def stale(self):
+        return self.recorded_folders() != FileIndex.scan_folders(self.data_root)
+
+    @classmethod
+    def load(cls, data_root):
+        """
+        Loads the table of data_root. It is built if it does not exist and updated if folders changed; processes are
+        serialized by a lock file, so the table is built by the first process only.
+        """
+        index = cls.read(data_root)
+        if index is not None and not index.stale():
+            return index
+
+        with FileLock(cls.path(data_root) + '.lock'):
+            # another process may have updated the table while this one waited
+            index = cls.read(data_root)
+            if index is None:
+                print('Building file index of {}...'.format(data_root))
+                return cls.build(data_root)
+            if index.stale():
+                print('Updating file index of {}...'.format(data_root))
+                return cls.build(data_root, previous=index)
+            return index
+
+    def select(self, machine_type, machine_id, split):
+        """ Returns the rows of the files of one machine and split, in sorted path order. """
+        mask = (self.machine_types == machine_type) & (self.machine_ids == machine_id) & (self.splits == split)
+        return np.nonzero(mask)[0]
+
+    def files(self, rows):
+        return [os.path.join(self.data_root, p) for p in self.paths[rows]]
+
+    def signatures(self, rows):
+        """
+        Same as feature_store.file_signatures: the files are stat-ed, so files modified in place since they were indexed
+        invalidate stores. Only the selected files are touched, nothing is globbed, parsed or decoded.
+        """
+        return file_signatures(self.files(rows))
+
+    def __len__(self):
+        return len(self.paths)
+
+
+@functools.lru_cache(maxsize=None)
+def load_file_index(data_root):
+    """ Process-wide cached FileIndex.load. """
+    return FileIndex.load(data_root)
+
+
+if __name__ == '__main__':
+
+    data_root = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.expanduser('~'), 'shared', 'dcase2020_task2')
+    with FileLock(FileIndex.path(data_root) + '.lock'):
+        index = FileIndex.build(data_root)
+    print('Indexed {} files in {}.'.format(len(index), FileIndex.path(data_root)))
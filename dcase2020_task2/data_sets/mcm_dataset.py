@@ -1,9 +1,13 @@
 import os
 import torch.utils.data
-import glob
 from dcase2020_task2.data_sets import BaseDataSet, CLASS_MAP, INVERSE_CLASS_MAP, TRAINING_ID_MAP, EVALUATION_ID_MAP, ALL_ID_MAP,\
     enumerate_development_datasets, enumerate_evaluation_datasets
-import librosa
+from dcase2020_task2.data_sets.feature_extraction import FeatureExtraction
+from dcase2020_task2.data_sets.feature_store import FeatureStore, FeatureCache, load_feature_store, cache_key, \
+    use_feature_store, FileLock, FEATURE_REGISTRY
+from dcase2020_task2.data_sets.window_index import WindowIndex
+from dcase2020_task2.data_sets.feature_server import share_feature_store
+from dcase2020_task2.data_sets.file_index import load_file_index
 import numpy as np
 
 
@@ -22,7 +26,11 @@ class MCMDataSet(BaseDataSet):
             fmin=0,
             normalize_raw=True,
             normalize_spec=False,
-            hop_all=False
+            hop_all=False,
+            num_extraction_workers=None,
+            extraction_backend='librosa',
+            storage_dtype='float32',
+            pcm_storage_dtype=None
     ):
         self.data_root = data_root
         self.context = context
@@ -34,6 +42,10 @@ class MCMDataSet(BaseDataSet):
         self.hop_all = hop_all
         self.normalize_raw = normalize_raw
         self.normalize_spec = normalize_spec
+        self.num_extraction_workers = num_extraction_workers
+        self.extraction_backend = extraction_backend
+        self.storage_dtype = storage_dtype
+        self.pcm_storage_dtype = pcm_storage_dtype
 
         kwargs = {
             'data_root': self.data_root,
@@ -45,7 +57,11 @@ class MCMDataSet(BaseDataSet):
             'normalize': self.normalize_raw,
             'fmin': self.fmin,
             'hop_all': self.hop_all,
-            'normalize_spec': self.normalize_spec
+            'normalize_spec': self.normalize_spec,
+            'num_extraction_workers': self.num_extraction_workers,
+            'extraction_backend': self.extraction_backend,
+            'storage_dtype': self.storage_dtype,
+            'pcm_storage_dtype': self.pcm_storage_dtype
         }
 
         if machine_id == -1:
@@ -75,8 +91,12 @@ class MCMDataSet(BaseDataSet):
     def validation_data_set(self):
         return self.validation_set
 
+    def file_index(self):
+        """ Table (path, machine type, id, label, ...) of the files behind the integer file_ids of all batches. """
+        return load_file_index(self.data_root)
 
-class MachineDataSet(torch.utils.data.Dataset):
+
+class MachineDataSet(FeatureExtraction, torch.utils.data.Dataset):
 
     def __init__(
             self,
@@ -92,7 +112,12 @@ class MachineDataSet(torch.utils.data.Dataset):
             normalize=True,
             normalize_spec=False,
             fmin=0,
-            hop_all=False
+            hop_all=False,
+            num_extraction_workers=None,
+            extraction_backend='librosa',
+            storage_dtype='float32',
+            pcm_storage_dtype=None,
+            lazy=False
     ):
 
         assert mode in ['training', 'validation']
@@ -112,74 +137,138 @@ class MachineDataSet(torch.utils.data.Dataset):
         self.fmin = fmin
         self.hop_all = hop_all
         self.normalize_spec = normalize_spec
+        self.num_extraction_workers = num_extraction_workers
+        self.extraction_backend = extraction_backend
+        self.storage_dtype = storage_dtype
+        self.pcm_storage_dtype = pcm_storage_dtype
+        self.max_file_length = None
 
-        if machine_id in TRAINING_ID_MAP[machine_type]:
-            root_folder = 'dev_data'
-        elif machine_id in EVALUATION_ID_MAP[machine_type]:
-            root_folder = 'eval_data'
-        else:
+        if machine_id not in TRAINING_ID_MAP[machine_type] and machine_id not in EVALUATION_ID_MAP[machine_type]:
             raise AttributeError
 
-        if mode == 'training':
-            files = glob.glob(
-                os.path.join(
-                    data_root, root_folder, self.machine_type, 'train', '*id_{:02d}_*.wav'.format(machine_id)
-                )
-            )
-        elif mode == 'validation':
-            files = glob.glob(
-                os.path.join(
-                    data_root, root_folder, self.machine_type, 'test', '*id_{:02d}_*.wav'.format(machine_id)
-                )
-            )
+        self.store = None
+        self.validated_key = None
+        self.cache_path = self.__cache_path__()
+        # taken before the store is validated, a store in use is never pruned
+        self.store_use = use_feature_store(self.cache_path)
+        self.__collect_files__()
+
+        if lazy:
+            key = cache_key(self.__feature_parameters__(), self.signatures)
+            # the access file is updated under the lock of the store, like by load_feature_store
+            with FileLock(self.cache_path + FeatureStore.LOCK_SUFFIX):
+                if FeatureStore.read_key(self.cache_path) == key:
+                    self.validated_key = key
+                    FeatureCache(self.data_root).touch(self.cache_path, hit=True)
+
+        if self.validated_key is not None:
+            # the store is valid, so opening it never requires a rebuild: it is opened on first access (possibly in a
+            # DataLoader worker), the window count is known from its index
+            self.index_map = self.__window_index__(FeatureStore.read_lengths(self.cache_path))
+            self.length = len(self.index_map)
         else:
-            raise AttributeError
+            # stores that have to be built or updated are loaded right away, in the process creating the data set
+            self.__materialize__()
 
-        assert len(files) > 0
+    def __collect_files__(self):
+        index = load_file_index(self.data_root)
+        split = 'train' if self.mode == 'training' else 'test'
+        rows = index.select(CLASS_MAP[self.machine_type], self.machine_id, split)
 
-        files = sorted(files)
+        assert len(rows) > 0
+
+        files = index.files(rows)
         self.files = files
+        # rows of the file index identify files in batches, see MCMDataSet.file_index
+        self.file_ids = rows.astype(np.int32)
+        self.targets = index.targets[rows]
+        self.machine_types = index.machine_types[rows]
+        self.machine_ids = index.machine_ids[rows]
+        self.signatures = index.signatures(rows)
+
+    def __materialize__(self):
+        """ Acquires the feature store; does nothing if this already happened. """
+        if self.store is not None:
+            return
+
+        if self.validated_key is not None:
+            self.store = FEATURE_REGISTRY.acquire(self.cache_path, self.__open_validated__)
+        else:
+            self.store = FEATURE_REGISTRY.acquire(
+                self.cache_path, lambda: self.__load_data__(self.files, self.signatures)
+            )
 
-        self.file_length = self.__load_preprocess_file__(files[0]).shape[-1]
+        index_map = self.__window_index__(self.store.lengths)
+        # lazy data sets may already be part of a ConcatDataset, their size must not change
+        assert not hasattr(self, 'length') or self.length == len(index_map), \
+            'feature cache {} changed since the data set was created'.format(self.cache_path)
+        self.index_map = index_map
+        self.length = len(index_map)
 
-        files = sorted(files)
-        self.files = files
-        self.meta_data = self.__load_meta_data__(files)
-        self.data = self.__load_data__(files)
-        self.index_map = {}
-        ctr = 0
-        for i, file in enumerate(self.data):
-            if hop_all:
-                residual = file.shape[-1] - context
-                self.index_map[ctr] = (i, residual)
-                ctr += 1
-            else:
-                for j in range(file.shape[-1] + 1 - context):
-                    self.index_map[ctr] = (i, j)
-                    ctr += 1
-        self.length = ctr
+    def __window_index__(self, lengths):
+        if self.hop_all:
+            # one randomly cropped window per file
+            return WindowIndex(np.minimum(lengths + 1 - self.context, 1))
+        return WindowIndex(lengths + 1 - self.context)
+
+    @property
+    def data(self):
+        self.__materialize__()
+        return self.store
 
     def __getitem__(self, item):
+        self.__materialize__()
         file_idx, offset = self.index_map[item]
         if self.hop_all:
-            offset = np.random.randint(0, offset)
-        observation = self.data[file_idx][:, offset:offset + self.context]
-        meta_data = self.meta_data[file_idx].copy()
-        meta_data['observations'] = observation[None]
-        return meta_data
+            offset = np.random.randint(0, self.data.lengths[file_idx] - self.context)
+        observation = self.data.window(file_idx, offset, self.context)
+        return {
+            'targets': int(self.targets[file_idx]),
+            'machine_types': int(self.machine_types[file_idx]),
+            'machine_ids': int(self.machine_ids[file_idx]),
+            'file_ids': int(self.file_ids[file_idx]),
+            'observations': observation[None]
+        }
+
+    def get_batch(self, items, crops=None):
+        """ Batched __getitem__: gathers all windows of items at once, see data_sets.batching. """
+        self.__materialize__()
+        file_indices, offsets = self.index_map.lookup(items)
+        if self.hop_all:
+            if crops is None:
+                crops = np.random.random_sample(len(file_indices))
+            offsets = (crops * (self.data.lengths[file_indices] - self.context)).astype(np.int64)
+        observations = np.empty((len(file_indices), 1) + self.data.feature_shape + (self.context,), dtype=np.float32)
+        self.data.windows(file_indices, offsets, self.context, out=observations[:, 0])
+        return {
+            'observations': observations,
+            'targets': self.targets[file_indices],
+            'machine_types': self.machine_types[file_indices],
+            'machine_ids': self.machine_ids[file_indices],
+            'file_ids': self.file_ids[file_indices]
+        }
 
     def __len__(self):
         return self.length
 
-    def __load_meta_data__(self, files):
-        data = []
-        for f in files:
-            md = self.__get_meta_data__(f)
-            data.append(md)
-        return data
+    @property
+    def file_length(self):
+        return int(self.data.lengths[0])
+
+    @property
+    def sample_rate(self):
+        return self.data.sample_rates[0]
+
+    @property
+    def num_channels(self):
+        return self.data.num_channels[0]
 
-    def __load_data__(self, files):
-        file_name = "{}_{}_{}_{}_{}_{}_{}_{}_{}_{}.npz".format(
+    def __del__(self):
+        if getattr(self, 'store', None) is not None:
+            FEATURE_REGISTRY.release(self.cache_path)
+
+    def __cache_name__(self):
+        return "{}_{}_{}_{}_{}_{}_{}_{}_{}_{}".format(
             self.num_mel,
             self.n_fft,
             self.hop_size,
@@ -191,75 +280,32 @@ class MachineDataSet(torch.utils.data.Dataset):
             self.fmin,
             self.normalize_spec
         )
-        file_path = os.path.join(self.data_root, file_name)
-
-        data = []
-        if os.path.exists(file_path):
-            print('Loading {} data set for machine type {} id {}...'.format(self.mode, self.machine_type,
-                                                                            self.machine_id))
-            container = np.load(file_path)
-            data = [container[key] for key in container]
-        else:
-            print('Loading & Saving {} data set for machine type {} id {}...'.format(self.mode, self.machine_type,
-                                                                            self.machine_id))
-            for i, f in enumerate(files):
-                file = self.__load_preprocess_file__(f)
-                data.append(file)
-            np.savez(file_path, *data)
-        return data
-
-    def __load_preprocess_file__(self, file):
-        x, sr = librosa.load(file, sr=None, mono=False)
-        if self.normalize:
-            x = (x - x.mean()) / x.std()
-
-        x = librosa.feature.melspectrogram(
-            y=x,
-            sr=sr,
-            n_fft=self.n_fft,
-            hop_length=self.hop_size,
-            n_mels=self.num_mel,
-            power=self.power,
-            fmin=self.fmin
-        )
 
-        if self.power == 1:
-            x = librosa.core.amplitude_to_db(x)
-        elif self.power == 2:
-            x = librosa.core.power_to_db(x)
-        else:
-            raise AttributeError
-
-        if self.normalize_spec:
-            x = (x - x.mean(axis=-1, keepdims=True)) / x.std(axis=-1, keepdims=True)
-
-        return x
-
-    def __get_meta_data__(self, file_path):
-        meta_data = os.path.split(file_path)[-1].split('_')
-        machine_type = os.path.split(os.path.split(os.path.split(file_path)[0])[0])[1]
-        machine_type = CLASS_MAP[machine_type]
-        assert self.machine_type == INVERSE_CLASS_MAP[machine_type]
-        if len(meta_data) == 4:
-            if meta_data[0] == 'normal':
-                y = 0
-            elif meta_data[0] == 'anomaly':
-                y = 1
-            else:
-                raise AttributeError
-            assert self.machine_id == int(meta_data[2])
-        elif len(meta_data) == 3:
-            y = -1
-            assert self.machine_id == int(meta_data[1])
-        else:
-            raise AttributeError
-
-        return {
-            'targets': y,
-            'machine_types': machine_type,
-            'machine_ids': self.machine_id,
-            'file_ids': os.sep.join(os.path.normpath(file_path).split(os.sep)[-4:])
-        }
+    def __source__(self, file):
+        # PCM and STFT stores hold the files of the data set
+        return '{}_{}_{}'.format(self.mode, self.machine_type, self.machine_id)
+
+    def __source_files__(self, name):
+        return self.files, self.signatures
+
+    def __open_validated__(self):
+        """ Opens the store validated on construction without taking its lock or verifying it again. """
+        store = FeatureStore.open(self.cache_path)
+        assert store.manifest.get('key') == self.validated_key, \
+            'feature cache {} changed since the data set was created'.format(self.cache_path)
+        return share_feature_store(store)
+
+    def __load_data__(self, files, signatures=None):
+        store = load_feature_store(
+            self.cache_path,
+            files,
+            self.__feature_parameters__(),
+            self.__extract_features__,
+            '{} data set for machine type {} id {}'.format(self.mode, self.machine_type, self.machine_id),
+            storage_dtype=self.storage_dtype,
+            signatures=signatures
+        )
+        return share_feature_store(store)
 
 
 if __name__ == '__main__':
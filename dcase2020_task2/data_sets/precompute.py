@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import concurrent.futures
+from dcase2020_task2.data_sets import INVERSE_CLASS_MAP, enumerate_development_datasets, \
+    enumerate_evaluation_datasets
+from dcase2020_task2.data_sets.mcm_dataset import MachineDataSet
+from dcase2020_task2.data_sets.audio_set_shards import AudioSetShards, SHARD_SIZE, list_audio_set_files
+from dcase2020_task2.data_sets.feature_extraction import FeatureExtraction
+from dcase2020_task2.data_sets.feature_store import FeatureStore
+from dcase2020_task2.data_sets.feature_server import ADDRESS_VARIABLE
+from dcase2020_task2.data_sets.file_index import load_file_index
+
+# feature settings of the experiment configurations (see fetaure_settings) and the extraction options
+SETTINGS = [
+    'context', 'num_mel', 'n_fft', 'hop_size', 'normalize_raw', 'power', 'fmin', 'hop_all', 'normalize_spec',
+    'extraction_backend', 'storage_dtype', 'pcm_storage_dtype'
+]
+
+
+def data_set_kwargs(settings, num_extraction_workers):
+    """ Maps feature settings to the keyword arguments of MachineDataSet and AudioSetShards. """
+    for key in settings:
+        if key not in SETTINGS:
+            raise AttributeError('Unknown feature setting: {}'.format(key))
+    # checked here instead of failing in every job
+    if settings.get('extraction_backend', 'librosa') not in FeatureExtraction.BACKENDS:
+        raise AttributeError('Unknown extraction backend: {}'.format(settings['extraction_backend']))
+    for key in ['storage_dtype', 'pcm_storage_dtype']:
+        if settings.get(key) is not None and settings[key] not in FeatureStore.STORAGE_DTYPES:
+            raise AttributeError('Unknown {}: {}'.format(key, settings[key]))
+    kwargs = {'normalize' if k == 'normalize_raw' else k: v for k, v in settings.items()}
+    kwargs['num_extraction_workers'] = num_extraction_workers
+    return kwargs
+
+
+def build(description, data_set_class, args, kwargs):
+    """ Creates one data set, which builds its store unless it is valid; returns statistics of the build. """
+    # copies in shared memory are of no use to a process that only builds stores
+    os.environ.pop(ADDRESS_VARIABLE, None)
+
+    start = time.time()
+    data_set = data_set_class(*args, **kwargs)
+    # AudioSetShards builds one store per shard
+    stores = data_set.stores if isinstance(data_set, AudioSetShards) else [data_set.data]
+    return {
+        'description': description,
+        'files': sum(len(store) for store in stores),
+        'nbytes': sum(store.nbytes for store in stores),
+        'seconds': time.time() - start,
+        # stores are rebuilt as a whole, a manifest older than the job belongs to a valid store
+        'skipped': all(os.path.getmtime(store.path + FeatureStore.MANIFEST_SUFFIX) < start for store in stores)
+    }
+
+
+def jobs(data_root, audio_set_root, kwargs):
+    """
+    One job per (machine type, id, mode) with files below data_root and per AudioSetShards shard below audio_set_root.
+    """
+    index = load_file_index(data_root)
+    for type_, id_ in enumerate_development_datasets() + enumerate_evaluation_datasets():
+        for mode, split in [('training', 'train'), ('validation', 'test')]:
+            if len(index.select(type_, id_, split)) == 0:
+                continue
+            yield (
+                '{} {} id {}'.format(mode, INVERSE_CLASS_MAP[type_], id_),
+                MachineDataSet,
+                (type_, id_),
+                dict(kwargs, data_root=data_root, mode=mode)
+            )
+
+    if audio_set_root is not None:
+        # AudioSetShards takes the feature settings as they are, shards have the default size
+        shard_kwargs = {'normalize_raw' if k == 'normalize' else k: v for k, v in kwargs.items()}
+        num_shards = (len(list_audio_set_files(audio_set_root)) + SHARD_SIZE - 1) // SHARD_SIZE
+        for shard_id in range(num_shards):
+            yield (
+                'audio set shard {}'.format(shard_id),
+                AudioSetShards,
+                (),
+                dict(shard_kwargs, data_root=audio_set_root, shard_ids=[shard_id])
+            )
+
+
+def precompute(settings, data_root, audio_set_root=None, num_jobs=4):
+    """
+    Builds the feature stores of all data sets for settings, num_jobs data sets at a time; the files of each data set
+    are extracted by its share of the cores. Valid stores are opened and skipped, so an interrupted run can simply be
+    restarted. A failing job is reported and does not stop the others. Returns the statistics of all jobs, failed
+    jobs have an 'error' instead.
+    """
+    num_extraction_workers = max(1, (os.cpu_count() or 1) // num_jobs)
+    kwargs = data_set_kwargs(settings, num_extraction_workers)
+    # built once here instead of by every job
+    load_file_index(data_root)
+
+    all_jobs = list(jobs(data_root, audio_set_root, kwargs))
+    results = []
+    start = time.time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_jobs) as executor:
+        futures = {executor.submit(build, *job): job[0] for job in all_jobs}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                results.append({'description': futures[future], 'error': repr(e)})
+                print('[{}/{}] {}: failed with {!r}'.format(len(results), len(all_jobs), futures[future], e))
+                continue
+            results.append(result)
+            print('[{}/{}] {}: {} {} files, {:.1f} MB in {:.1f} s ({:.1f} files/s)'.format(
+                len(results),
+                len(all_jobs),
+                result['description'],
+                'skipped' if result['skipped'] else 'built',
+                result['files'],
+                result['nbytes'] / 2 ** 20,
+                result['seconds'],
+                result['files'] / max(result['seconds'], 1e-6)
+            ))
+
+    failed = [r for r in results if 'error' in r]
+    built = [r for r in results if 'error' not in r and not r['skipped']]
+    seconds = time.time() - start
+    print('Built {} of {} stores ({} files, {:.1f} MB) in {:.1f} s, {:.1f} files/s; {} failed.'.format(
+        len(built),
+        len(results),
+        sum(r['files'] for r in built),
+        sum(r['nbytes'] for r in built) / 2 ** 20,
+        seconds,
+        sum(r['files'] for r in built) / max(seconds, 1e-6),
+        len(failed)
+    ))
+    for r in failed:
+        print('Failed: {} ({})'.format(r['description'], r['error']))
+    return results
+
+
+if __name__ == '__main__':
+
+    # python -m dcase2020_task2.data_sets.precompute <feature settings json> [data root] [audio set root | none]
+    #   [parallel data sets]
+    # e.g. {"num_mel": 128, "n_fft": 1024, "hop_size": 512, "power": 2.0, "storage_dtype": "float16"}
+    with open(sys.argv[1], 'r') as f:
+        settings = json.load(f)
+    data_root = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.expanduser('~'), 'shared', 'dcase2020_task2')
+    audio_set_root = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3] != 'none' else None
+    num_jobs = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+
+    precompute(settings, data_root, audio_set_root=audio_set_root, num_jobs=num_jobs)
@@ -0,0 +1,68 @@
+import os
+import sys
+import time
+import torch.utils.data
+import numpy as np
+from dcase2020_task2.data_sets.feature_store import FeatureStore
+from dcase2020_task2.data_sets.window_index import WindowIndex
+from dcase2020_task2.data_sets.batching import WindowBatchSampler
+
+
+def evict(path):
+    """ Drops the pages of path from the page cache; pages still mapped by some process stay resident. """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def benchmark(path, batches, context, num_batches):
+    """
+    Reads the windows of the first num_batches batches from the store at path, starting with a cold page cache.
+    Returns windows per second and the mean number of distinct files per batch (a full shuffle draws nearly every
+    window of a batch from a different file).
+    """
+    evict(FeatureStore.open(path).data_path)
+    store = FeatureStore.open(path)
+    index = WindowIndex(store.lengths + 1 - context)
+
+    num_windows = 0
+    files_per_batch = []
+    start = time.time()
+    for i, items in enumerate(batches):
+        if i == num_batches:
+            break
+        file_indices, offsets = index.lookup(items)
+        store.windows(file_indices, offsets, context)
+        num_windows += len(file_indices)
+        files_per_batch.append(len(np.unique(file_indices)))
+    return num_windows / (time.time() - start), float(np.mean(files_per_batch))
+
+
+if __name__ == '__main__':
+
+    # python -m dcase2020_task2.data_sets.sampler_benchmark <store path> [context] [batch size] [block size]
+    #   [buffer size]
+    path = sys.argv[1]
+    context = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    batch_size = int(sys.argv[3]) if len(sys.argv) > 3 else 512
+    block_size = int(sys.argv[4]) if len(sys.argv) > 4 else 1024
+    buffer_size = int(sys.argv[5]) if len(sys.argv) > 5 else None
+    num_batches = 200
+
+    num_items = int(np.maximum(FeatureStore.read_lengths(path) + 1 - context, 0).sum())
+    random_batches = torch.utils.data.BatchSampler(
+        torch.utils.data.RandomSampler(range(num_items)), batch_size, drop_last=False
+    )
+    block_sampler = WindowBatchSampler(
+        num_items, batch_size, shuffle=True, seed=0, block_size=block_size, buffer_size=buffer_size
+    )
+    block_batches = (indices for indices, _ in block_sampler)
+
+    print('{} windows of {} frames, {} batches of {}, cold page cache'.format(
+        num_items, context, num_batches, batch_size
+    ))
+    for name, batches in [('RandomSampler', random_batches), ('block shuffle', block_batches)]:
+        windows_per_second, files_per_batch = benchmark(path, batches, context, num_batches)
+        print('{:<16}{:>12.0f} windows/s{:>10.1f} files/batch'.format(name, windows_per_second, files_per_batch))
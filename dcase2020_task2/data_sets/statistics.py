@@ -0,0 +1,85 @@
+import torch.utils.data
+import numpy as np
+
+
+class RunningStatistics:
+    """
+    Single-pass, per-bin feature statistics (count, mean, sum of squared deviations, min, max).
+
+    Chunks of frames are merged with the parallel variant of Welford's algorithm (Chan et al.), so statistics can be
+    accumulated over arbitrarily large stores without holding them in memory and can be combined across data sets.
+    """
+
+    def __init__(self, feature_shape):
+        self.count = 0
+        self.mean = np.zeros(feature_shape, dtype=np.float64)
+        self.m2 = np.zeros(feature_shape, dtype=np.float64)
+        self.min = np.full(feature_shape, np.inf, dtype=np.float64)
+        self.max = np.full(feature_shape, -np.inf, dtype=np.float64)
+
+    def update(self, x):
+        """ Adds a chunk of frames with shape (frames, *feature_shape). """
+        if len(x) == 0:
+            return
+        x = x.astype(np.float64)
+        chunk = RunningStatistics(self.mean.shape)
+        chunk.count = len(x)
+        chunk.mean = x.mean(axis=0)
+        chunk.m2 = ((x - chunk.mean) ** 2).sum(axis=0)
+        chunk.min = x.min(axis=0)
+        chunk.max = x.max(axis=0)
+        self.merge(chunk)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count)
+
+    @property
+    def global_mean(self):
+        return self.mean.mean()
+
+    @property
+    def global_std(self):
+        # every bin has the same number of frames
+        return np.sqrt((self.m2 / self.count + (self.mean - self.global_mean) ** 2).mean())
+
+    @property
+    def global_min(self):
+        return self.min.min()
+
+    @property
+    def global_max(self):
+        return self.max.max()
+
+    def state_dict(self):
+        return {'count': self.count, 'mean': self.mean, 'm2': self.m2, 'min': self.min, 'max': self.max}
+
+    @classmethod
+    def from_state_dict(cls, state):
+        statistics = cls(state['mean'].shape)
+        statistics.count = int(state['count'])
+        for key in ['mean', 'm2', 'min', 'max']:
+            setattr(statistics, key, state[key])
+        return statistics
+
+
+def data_set_statistics(data_set):
+    """ Merged statistics of all feature stores in data_set, which may be nested in ConcatDatasets. """
+    if isinstance(data_set, torch.utils.data.ConcatDataset):
+        members = [data_set_statistics(d) for d in data_set.datasets]
+        statistics = RunningStatistics(members[0].mean.shape)
+        for s in members:
+            statistics.merge(s)
+        return statistics
+    return data_set.data.statistics()
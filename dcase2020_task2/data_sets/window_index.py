@@ -0,0 +1,31 @@
+import numpy as np
+
+
+class WindowIndex:
+    """
+    Maps a flat window index to (file index, window index within the file).
+
+    Only the cumulative number of windows per file is stored; items are resolved with a binary search instead of
+    keeping one Python tuple per window.
+    """
+
+    def __init__(self, windows_per_file):
+        windows_per_file = np.maximum(np.asarray(windows_per_file, dtype=np.int64), 0)
+        self.offsets = np.concatenate([[0], np.cumsum(windows_per_file)]).astype(np.int64)
+
+    def lookup(self, items):
+        """ Vectorized lookup, returns arrays of file indices and window indices. """
+        items = np.asarray(items, dtype=np.int64)
+        if np.any(items < 0) or np.any(items >= len(self)):
+            raise IndexError
+        file_indices = np.searchsorted(self.offsets, items, side='right') - 1
+        return file_indices, items - self.offsets[file_indices]
+
+    def __getitem__(self, item):
+        if item < 0 or item >= len(self):
+            raise IndexError
+        file_idx = int(np.searchsorted(self.offsets, item, side='right')) - 1
+        return file_idx, int(item - self.offsets[file_idx])
+
+    def __len__(self):
+        return int(self.offsets[-1])
@@ -3,6 +3,7 @@ import pytorch_lightning as pl
 import torch
 from sacred import Experiment
 from dcase2020_task2.utils.logger import Logger
+from dcase2020_task2.utils.prefetcher import Prefetcher
 import os
 import numpy as np
 import torch.utils.data
@@ -11,7 +12,9 @@ from sacred import SETTINGS
 
 SETTINGS['CAPTURE_MODE'] = 'sys'
 from datetime import datetime
-from dcase2020_task2.data_sets import AudioSet, ComplementMCMDataSet
+from dcase2020_task2.data_sets import AudioSetShards, ComplementMCMDataSet
+from dcase2020_task2.data_sets.statistics import data_set_statistics
+from dcase2020_task2.data_sets.batching import batch_data_loader, mixed_batch_data_loader
 
 
 class ClassificationExperiment(BaseExperiment, pl.LightningModule):
@@ -32,39 +35,70 @@ class ClassificationExperiment(BaseExperiment, pl.LightningModule):
         # will be set before each epoch
         self.normal_data_set = self.objects['data_set']
 
-        self.abnormal_data_set = ComplementMCMDataSet(
-            self.objects['machine_type'],
-            self.objects['machine_id'],
-            valid_types=self.objects['valid_types'],
-            **self.objects['fetaure_settings']
-        )
-
-        # self.abnormal_data_set = AudioSet(
-        #     **self.objects['fetaure_settings']
-        # )
+        if self.objects.get('complement', 'mcm') == 'mcm':
+            self.abnormal_data_set = ComplementMCMDataSet(
+                self.objects['machine_type'],
+                self.objects['machine_id'],
+                valid_types=self.objects['valid_types'],
+                **self.objects['fetaure_settings']
+            )
+        elif self.objects.get('complement') == 'audio_set':
+            # streamed from shards, complement batches are drawn by the data set itself
+            self.abnormal_data_set = AudioSetShards(
+                batch_size=self.objects['batch_size'],
+                seed=self.objects['seed'] + 1,
+                **self.objects['fetaure_settings']
+            )
+        else:
+            raise AttributeError
 
+        self.register_buffer('normalization_scale', None)
+        self.register_buffer('normalization_shift', None)
         if self.objects.get('normalize_dataset') is None:
             print('No normalization.')
-        elif self.objects.get('normalize_dataset') is 'min_max':
-            print('Min/Max normalization.')
-            self.min, self.max = None, None
-            raise NotImplementedError
-        elif self.objects.get('normalize_dataset') is 'mean_std':
-            print('Mean/Std normalization.')
-            self.mean, self.std = None, None
-            raise NotImplementedError
+        elif self.objects.get('normalize_dataset') in ['min_max', 'mean_std']:
+            self.__init_normalization__(
+                self.objects.get('normalize_dataset'),
+                self.objects.get('normalize_per_bin', False)
+            )
         else:
             raise AttributeError
 
-        self.inf_data_loader = self.get_inf_data_loader(
-            torch.utils.data.DataLoader(
+        if self.objects.get('mixed_batches'):
+            # complement batches are mixed in by the training data loader
+            assert self.objects.get('complement', 'mcm') == 'mcm', 'mixed batches need a map-style complement'
+            self.abnormal_sampler = None
+            self.abnormal_data_loader = None
+        elif self.objects.get('complement') == 'audio_set':
+            abnormal_data_loader = torch.utils.data.DataLoader(
+                self.abnormal_data_set.training_data_set(),
+                batch_size=None,
+                num_workers=self.objects['num_workers']
+            )
+            self.abnormal_sampler = None
+            self.abnormal_data_loader = abnormal_data_loader
+        else:
+            abnormal_data_loader = batch_data_loader(
                 self.abnormal_data_set.training_data_set(),
                 batch_size=self.objects['batch_size'],
                 shuffle=True,
                 num_workers=self.objects['num_workers'],
-                drop_last=True
+                drop_last=True,
+                seed=self.objects['seed'] + 1,
+                block_size=self.objects.get('shuffle_block_size'),
+                buffer_size=self.objects.get('shuffle_buffer_size')
             )
-        )
+            self.abnormal_sampler = abnormal_data_loader.sampler
+            self.abnormal_data_loader = abnormal_data_loader
+
+        # started with the first training step, after checkpoints restored the sampler
+        self.inf_data_loader = None
+        self.abnormal_sampler_start = None
+
+        # restored from checkpoints, applied when the training data loader is created
+        self.normal_sampler = None
+        self.normal_sampler_state = None
+        self.normal_sampler_start = None
 
         # experiment state variables
         self.epoch = -1
@@ -72,12 +106,24 @@ class ClassificationExperiment(BaseExperiment, pl.LightningModule):
         self.result = None
 
     def get_inf_data_loader(self, dl):
-        device = next(iter(self.network.parameters())).device
+        self.prefetcher = Prefetcher(self.__repeat__(dl), depth=self.objects.get('prefetch_depth', 4))
+        return self.__to_device__(self.prefetcher)
+
+    def __to_device__(self, batches):
+        device = None
+        for batch in batches:
+            # parameters are moved to the GPU after construction, look up the device on first use
+            if device is None:
+                device = next(iter(self.network.parameters())).device
+            for key in batch:
+                if type(batch[key]) is torch.Tensor:
+                    batch[key] = batch[key].to(device, non_blocking=True)
+            yield batch
+
+    @staticmethod
+    def __repeat__(dl):
         while True:
             for batch in iter(dl):
-                for key in batch:
-                    if type(batch[key]) is torch.Tensor:
-                        batch[key] = batch[key].to(device)
                 yield batch
 
     def forward(self, batch):
@@ -85,13 +131,48 @@ class ClassificationExperiment(BaseExperiment, pl.LightningModule):
         batch = self.network(batch)
         return batch
 
+    def __init_normalization__(self, normalize_dataset, per_bin):
+        statistics = data_set_statistics(self.normal_data_set.training_data_set())
+        if normalize_dataset == 'min_max':
+            print('Min/Max normalization.')
+            low, high = (statistics.min, statistics.max) if per_bin else (statistics.global_min, statistics.global_max)
+            # (((x - min) / (max - min)) - 0.5) * 2
+            scale = 2 / (high - low)
+            shift = -low * scale - 1
+        else:
+            print('Mean/Std normalization.')
+            mean, std = (statistics.mean, statistics.std) if per_bin else (statistics.global_mean, statistics.global_std)
+            scale = 1 / std
+            shift = -mean * scale
+
+        # broadcast over (batch, channel, num_mel, context)
+        shape = (1, 1, -1, 1) if per_bin else (1, 1, 1, 1)
+        self.register_buffer('normalization_scale', torch.tensor(scale, dtype=torch.float32).reshape(shape))
+        self.register_buffer('normalization_shift', torch.tensor(shift, dtype=torch.float32).reshape(shape))
+
     def normalize_batch(self, batch):
-        if self.objects.get('normalize_dataset') is 'min_max':
-            assert self.mean is None
-            batch['observations'] = (((batch['observations'] - self.min) / (self.max - self.min)) - 0.5) * 2
-        elif self.objects.get('normalize_dataset') is 'mean_std':
-            assert self.min is None
-            batch['observations'] = (batch['observations'] - self.mean) / self.std
+        if self.normalization_scale is not None:
+            batch['observations'] = torch.addcmul(
+                self.normalization_shift,
+                batch['observations'],
+                self.normalization_scale
+            )
+
+    def __append_abnormal_batch__(self, batch_normal, abnormal_batch):
+        normal_batch_size = len(batch_normal['observations'])
+        abnormal_batch_size = len(abnormal_batch['observations'])
+
+        device = batch_normal['observations'].device
+
+        batch_normal['abnormal'] = torch.cat([
+            torch.zeros(normal_batch_size, 1).to(device),
+            torch.ones(abnormal_batch_size, 1).to(device)
+        ])
+
+        batch_normal['observations'] = torch.cat([
+            batch_normal['observations'],
+            abnormal_batch['observations']
+        ])
 
     def training_step(self, batch_normal, batch_num, optimizer_idx=0):
 
@@ -99,25 +180,16 @@ class ClassificationExperiment(BaseExperiment, pl.LightningModule):
             self.epoch += 1
 
         if optimizer_idx == 0:
-            abnormal_batch = next(self.inf_data_loader)
+            if self.abnormal_data_loader is not None:
+                if self.inf_data_loader is None:
+                    # the prefetcher starts drawing batches right away, take the state before
+                    if self.abnormal_sampler is not None:
+                        self.abnormal_sampler_start = (self.abnormal_sampler.state_dict(), self.step)
+                    self.inf_data_loader = self.get_inf_data_loader(self.abnormal_data_loader)
+                self.__append_abnormal_batch__(batch_normal, next(self.inf_data_loader))
+                batch_normal.update(self.prefetcher.statistics())
 
             self.normalize_batch(batch_normal)
-            self.normalize_batch(abnormal_batch)
-
-            normal_batch_size = len(batch_normal['observations'])
-            abnormal_batch_size = len(abnormal_batch['observations'])
-
-            device = batch_normal['observations'].device
-
-            batch_normal['abnormal'] = torch.cat([
-                torch.zeros(normal_batch_size, 1).to(device),
-                torch.ones(abnormal_batch_size, 1).to(device)
-            ])
-
-            batch_normal['observations'] = torch.cat([
-                batch_normal['observations'],
-                abnormal_batch['observations']
-            ])
 
             batch_normal = self(batch_normal)
 
@@ -134,6 +206,7 @@ class ClassificationExperiment(BaseExperiment, pl.LightningModule):
         }
 
     def validation_step(self, batch, batch_num):
+        self.normalize_batch(batch)
         self(batch)
         return {
             'targets': batch['targets'],
@@ -156,15 +229,57 @@ class ClassificationExperiment(BaseExperiment, pl.LightningModule):
         return self.result
 
     def train_dataloader(self):
-        dl = torch.utils.data.DataLoader(
-            self.objects['data_set'].training_data_set(),
-            batch_size=self.objects['batch_size'],
-            shuffle=True,
-            num_workers=self.objects['num_workers'],
-            drop_last=False
-        )
+        if self.objects.get('mixed_batches'):
+            dl = mixed_batch_data_loader(
+                self.objects['data_set'].training_data_set(),
+                self.abnormal_data_set.training_data_set(),
+                batch_size=self.objects['batch_size'],
+                complement_ratio=self.objects.get('complement_ratio', 1.0),
+                num_workers=self.objects['num_workers'],
+                seed=self.objects['seed'],
+                block_size=self.objects.get('shuffle_block_size'),
+                buffer_size=self.objects.get('shuffle_buffer_size')
+            )
+        else:
+            dl = batch_data_loader(
+                self.objects['data_set'].training_data_set(),
+                batch_size=self.objects['batch_size'],
+                shuffle=True,
+                num_workers=self.objects['num_workers'],
+                drop_last=False,
+                seed=self.objects['seed'],
+                block_size=self.objects.get('shuffle_block_size'),
+                buffer_size=self.objects.get('shuffle_buffer_size')
+            )
+        self.normal_sampler = dl.sampler
+        if self.normal_sampler_state is not None:
+            self.normal_sampler.load_state_dict(self.normal_sampler_state)
+        self.normal_sampler_start = (self.normal_sampler.state_dict(), self.step)
         return dl
 
+    def __consumed_state__(self, sampler, start):
+        # every training step consumes one batch of each loader, workers and the prefetcher run ahead of that
+        if start is None:
+            return sampler.state_dict()
+        state, step = start
+        return sampler.advance(state, self.step - step)
+
+    def on_save_checkpoint(self, checkpoint):
+        # crop positions and shuffling of both loaders are fully determined by the sampler states
+        if self.abnormal_sampler is not None:
+            checkpoint['abnormal_sampler'] = self.__consumed_state__(self.abnormal_sampler, self.abnormal_sampler_start)
+        if self.normal_sampler is not None:
+            checkpoint['normal_sampler'] = self.__consumed_state__(self.normal_sampler, self.normal_sampler_start)
+
+    def on_load_checkpoint(self, checkpoint):
+        if 'abnormal_sampler' in checkpoint and self.abnormal_sampler is not None:
+            self.abnormal_sampler.load_state_dict(checkpoint['abnormal_sampler'])
+        if 'normal_sampler' in checkpoint:
+            self.normal_sampler_state = checkpoint['normal_sampler']
+            if self.normal_sampler is not None:
+                self.normal_sampler.load_state_dict(self.normal_sampler_state)
+                self.normal_sampler_start = (self.normal_sampler.state_dict(), self.step)
+
 
 def configuration():
     seed = 1220
@@ -203,6 +318,17 @@ def configuration():
 
     loss_class = 'dcase2020_task2.losses.BCE'
     batch_size = 32
+    # single loader with normal and complement windows in each batch (complement_ratio complement per normal window)
+    mixed_batches = True
+    complement_ratio = 1.0
+    # complement data set: 'mcm' (other machine types/ids) or 'audio_set' (streamed shards, needs mixed_batches False)
+    complement = 'mcm'
+    # number of complement batches kept ready by a background thread if mixed_batches is False
+    prefetch_depth = 4
+    # shuffle blocks of adjacent windows instead of single windows (see batching.block_shuffle), None for a full
+    # shuffle; benchmark with python -m dcase2020_task2.data_sets.sampler_benchmark
+    shuffle_block_size = None
+    shuffle_buffer_size = None
     learning_rate = 1e-4
     weight_decay = 0
     learning_rate_decay = 0.99
@@ -210,6 +336,7 @@ def configuration():
     normalize_raw = True
     normalize_spec = False
     normalize_dataset = None
+    normalize_per_bin = False
 
     # TODO: change default descriptor
     descriptor = "ClassificationExperiment_Model:[{}_{}_{}_{}]_Training:[{}_{}_{}_{}]_Features:[{}_{}_{}_{}_{}_{}_{}]_{}".format(
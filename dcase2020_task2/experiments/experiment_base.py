@@ -2,7 +2,9 @@ from typing import NoReturn
 from abc import ABC, abstractmethod
 import torch
 from dcase2020_task2.experiments.parser import create_objects_from_config
+from dcase2020_task2.data_sets.batching import batch_data_loader
 import copy
+import gc
 import os
 from pathlib import Path
 
@@ -62,17 +64,19 @@ class BaseExperiment(ABC, torch.nn.Module):
         return optimizers, lr_schedulers
 
     def train_dataloader(self):
-        dl = torch.utils.data.DataLoader(
+        dl = batch_data_loader(
             self.objects['data_set'].training_data_set(),
             batch_size=self.objects['batch_size'],
             shuffle=True,
             num_workers=self.objects['num_workers'],
-            drop_last=False
+            drop_last=False,
+            block_size=self.objects.get('shuffle_block_size'),
+            buffer_size=self.objects.get('shuffle_buffer_size')
         )
         return dl
 
     def val_dataloader(self):
-        dl = torch.utils.data.DataLoader(
+        dl = batch_data_loader(
             self.objects['data_set'].validation_data_set(),
             batch_size=self.objects['batch_size'],
             shuffle=False,
@@ -81,7 +85,7 @@ class BaseExperiment(ABC, torch.nn.Module):
         return dl
 
     def test_dataloader(self):
-        dl = torch.utils.data.DataLoader(
+        dl = batch_data_loader(
             self.objects['data_set'].validation_data_set(),
             batch_size=self.objects['batch_size'],
             shuffle=False,
@@ -90,6 +94,9 @@ class BaseExperiment(ABC, torch.nn.Module):
         return dl
 
     def run(self):
+        # data sets are built by now; moving their objects out of the collector's reach keeps forked DataLoader
+        # workers from copying the pages they live on
+        gc.freeze()
         self.trainer.fit(self)
         self.trainer.test(self)
         self.trainer.save_checkpoint(os.path.join(self.objects['log_path'], "model.ckpt"))
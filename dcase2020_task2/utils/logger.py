@@ -93,7 +93,8 @@ class Logger:
         )
 
         result = self.__compute_metrics__(scores_mean, scores_max, ground_truth, machine_types, machine_ids)
-        file_ids = np.array([f.split(os.sep)[-1] for f in file_ids])
+        paths = self.objects['data_set'].file_index().paths
+        file_ids = np.array([f.split(os.sep)[-1] for f in paths[file_ids]])
 
         self.__plot_score_distribution__(scores_mean, scores_max, ground_truth, machine_types, machine_ids)
 
@@ -238,44 +239,38 @@ class Logger:
         predictions_ = np.concatenate([o['scores'].detach().cpu().numpy() for o in outputs])
         machine_types_ = np.concatenate([o['machine_types'].detach().cpu().numpy() for o in outputs])
         machine_ids_ = np.concatenate([o['machine_ids'].detach().cpu().numpy() for o in outputs])
+        file_ids_ = np.concatenate([o['file_ids'].detach().cpu().numpy() for o in outputs])
 
-        file_indices_map = {}
-        idx = 0
-        for o in outputs:
-            for file_name in o['file_ids']:
-                file_indices_map.setdefault(file_name, []).append(idx)
-                idx += 1
+        # group windows by their integer file id; first holds the first window of every file
+        unique_files, first, inverse, counts = np.unique(
+            file_ids_, return_index=True, return_inverse=True, return_counts=True
+        )
+        window_scores = predictions_.reshape(len(file_ids_), -1)
 
-        targets = []
-        scores_mean = []
-        scores_max = []
+        scores_mean = np.bincount(inverse, weights=window_scores.mean(axis=1)) / counts
+        scores_max = np.full(len(unique_files), -np.inf)
+        np.maximum.at(scores_max, inverse, window_scores.max(axis=1))
         scores_custom = []
-        machine_types = []
-        machine_ids = []
-        unique_files = np.unique(list(file_indices_map.keys()))
-
-        for f in unique_files:
-            indices = file_indices_map[f]
-
-            targets.append(targets_[indices[0]])
-            scores_mean.append(np.mean(predictions_[indices]))
-            scores_max.append(np.max(predictions_[indices]))
-            if aggregation_fun:
+        if aggregation_fun:
+            order = np.argsort(inverse, kind='stable')
+            for indices in np.split(order, np.cumsum(counts)[:-1]):
                 scores_custom.append(aggregation_fun(predictions_[indices]))
-            machine_types.append(machine_types_[indices[0]])
-            machine_ids.append(machine_ids_[indices[0]])
 
-            assert all(machine_types[-1] == machine_types_[indices])
-            assert all(machine_ids[-1] == machine_ids_[indices])
-            assert all(targets[-1] == targets_[indices])
+        targets = targets_[first]
+        machine_types = machine_types_[first]
+        machine_ids = machine_ids_[first]
+
+        assert all(machine_types[inverse] == machine_types_)
+        assert all(machine_ids[inverse] == machine_ids_)
+        assert all(targets[inverse] == targets_)
 
-        return np.array(scores_mean), \
-               np.array(scores_max), \
+        return scores_mean, \
+               scores_max, \
                np.array(scores_custom), \
-               np.array(targets), \
-               np.array(unique_files), \
-               np.array(machine_types), \
-               np.array(machine_ids)
+               targets, \
+               unique_files, \
+               machine_types, \
+               machine_ids
 
     def __log_metric__(self, name, value, step):
 
@@ -0,0 +1,64 @@
+import time
+import queue
+import threading
+import torch
+
+
+class Prefetcher:
+    """
+    Iterates over iterable in a background thread and keeps up to depth items ready in a bounded queue.
+
+    Tensors are moved to pinned memory by the background thread (if CUDA is available), so the consumer can copy them
+    to the GPU with non_blocking=True. Queue depth and the time the consumer waited for items are recorded to check
+    whether loading is hidden behind compute.
+    """
+
+    __END__ = object()
+
+    def __init__(self, iterable, depth=4, pin_memory=None):
+        self.depth = depth
+        self.pin_memory = torch.cuda.is_available() if pin_memory is None else pin_memory
+        self.queue = queue.Queue(maxsize=depth)
+
+        self.num_items = 0
+        self.total_depth = 0
+        self.stall_time = 0.0
+
+        self.thread = threading.Thread(target=self.__fill__, args=(iterable,), daemon=True)
+        self.thread.start()
+
+    def __fill__(self, iterable):
+        try:
+            for item in iterable:
+                if self.pin_memory:
+                    item = {
+                        k: v.pin_memory() if type(v) is torch.Tensor else v for k, v in item.items()
+                    }
+                self.queue.put(item)
+        except Exception as e:
+            self.queue.put(e)
+        self.queue.put(Prefetcher.__END__)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.total_depth += self.queue.qsize()
+        start = time.time()
+        item = self.queue.get()
+        self.stall_time += time.time() - start
+
+        if item is Prefetcher.__END__:
+            raise StopIteration
+        if isinstance(item, Exception):
+            raise item
+
+        self.num_items += 1
+        return item
+
+    def statistics(self):
+        """ Mean queue depth seen by the consumer and accumulated stall time in seconds. """
+        return {
+            'prefetch_queue_depth': self.total_depth / max(1, self.num_items),
+            'prefetch_stall_time': self.stall_time
+        }
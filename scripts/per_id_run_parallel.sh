@@ -1,5 +1,20 @@
 conda activate dcase2020_task2
 
+# keeps the feature caches in shared memory for all runs on this node
+export DCASE2020_TASK2_FEATURE_SERVER=/tmp/dcase2020_task2_feature_server_$$
+# started outside of this shell, so that the wait below does not wait for it
+FEATURE_SERVER_PID=$(python -m dcase2020_task2.data_sets.feature_server $DCASE2020_TASK2_FEATURE_SERVER > /dev/null 2>&1 & echo $!)
+for i in $(seq 60); do
+  if [ -S $DCASE2020_TASK2_FEATURE_SERVER ] || ! kill -0 $FEATURE_SERVER_PID 2> /dev/null; then break; fi
+  sleep 1
+done
+if [ ! -S $DCASE2020_TASK2_FEATURE_SERVER ]; then
+  # runs read their feature caches from disk
+  echo "Feature server did not start."
+  kill $FEATURE_SERVER_PID 2> /dev/null
+  unset DCASE2020_TASK2_FEATURE_SERVER
+fi
+
 OMP_NUM_THREADS=1 CUDA_VISIBLE_DEVICES=0 python -m dcase2020_task2.experiments.$1 with num_workers=4 machine_type=0 machine_id=0 $2 &
 OMP_NUM_THREADS=1 CUDA_VISIBLE_DEVICES=1 python -m dcase2020_task2.experiments.$1 with num_workers=4 machine_type=0 machine_id=1 $2 > /dev/null 2>&1 &
 OMP_NUM_THREADS=1 CUDA_VISIBLE_DEVICES=2 python -m dcase2020_task2.experiments.$1 with num_workers=4 machine_type=0 machine_id=2 $2 > /dev/null 2>&1 &
@@ -61,4 +76,8 @@ OMP_NUM_THREADS=1 CUDA_VISIBLE_DEVICES=2 python -m dcase2020_task2.experiments.$
 OMP_NUM_THREADS=1 CUDA_VISIBLE_DEVICES=3 python -m dcase2020_task2.experiments.$1 with num_workers=4 machine_type=5 machine_id=5 $2 > /dev/null 2>&1 &
 wait
 OMP_NUM_THREADS=1 CUDA_VISIBLE_DEVICES=0 python -m dcase2020_task2.experiments.$1 with num_workers=4 machine_type=5 machine_id=6 $2 > /dev/null 2>&1 &
-wait
\ No newline at end of file
+wait
+
+if [ -n "$DCASE2020_TASK2_FEATURE_SERVER" ]; then
+  python -m dcase2020_task2.data_sets.feature_server $DCASE2020_TASK2_FEATURE_SERVER stop
+fi